@@ -4,6 +4,10 @@ import boto3
 from telegram import Bot, Update
 import requests
 import openai
+from redshift_results import decode_page, to_text_rows
+from schema_cache import get_catalog, invalidate_catalog, find_table_columns
+from sql_cache import build_sql_cache, schema_fingerprint, DEFAULT_MAX_ENTRIES
+from result_cache import ResultCache
 
 # Configuración inicial
 TELEGRAM_BOT_TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
@@ -19,24 +23,37 @@ if not OPENAI_API_KEY:
 
 openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
+# Cache pregunta -> SQL. Si cambian las reglas del prompt hay que subir PROMPT_VERSION para no reutilizar SQL viejo
+PROMPT_VERSION = 2
+
+# Tablas de resumen de gastos que mantiene load_data, se anuncian en el prompt para que las consultas usuales no agreguen filas crudas
+SUMMARY_TABLES = {
+    'spend_daily_summary': "spend_daily_summary: fecha, fuente, categoria, comercio, divisa, monto_total, cantidad, monto_maximo",
+    'spend_monthly_summary': "spend_monthly_summary: mes, fuente, categoria, comercio, divisa, monto_total, cantidad, monto_maximo",
+}
+sql_cache = build_sql_cache(
+    os.environ.get("SQL_CACHE_TABLE"),
+    int(os.environ.get("SQL_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+)
+
+# Cache de resultados por SQL y version de datos de las tablas consultadas
+result_cache = ResultCache()
+
 def get_table_columns_by_prefix(database: str, table_prefix: str) -> list:
-    """Busca una tabla por prefijo y devuelve sus columnas"""
+    """Busca una tabla por prefijo en el catálogo cacheado y devuelve sus columnas"""
     try:
-        paginator = glue_client.get_paginator('get_tables')
-        for page in paginator.paginate(DatabaseName=database):
-            for table in page['TableList']:
-                table_name = table['Name']
-                if table_name.startswith(table_prefix):
-                    print(f"✅ Usando tabla encontrada: {table_name}")
-                    return [col['Name'] for col in table['StorageDescriptor']['Columns']]
+        table_name, columns = find_table_columns(get_catalog(glue_client, database), table_prefix)
+        if table_name:
+            print(f"✅ Usando tabla encontrada: {table_name}")
+            return columns
         print(f"⚠️ No se encontró ninguna tabla con prefijo '{table_prefix}' en el catálogo.")
         return []
     except Exception as e:
         print(f"❌ Error al buscar tablas con prefijo '{table_prefix}': {e}")
         return []
 
-def generate_sql_with_openai(question: str) -> str:
-    """Genera SQL usando OpenAI GPT"""
+def generate_sql_with_openai(question: str) -> tuple:
+    """Genera SQL usando OpenAI GPT, devuelve (sql, huella del esquema, si vino del cache)"""
     
     try:
         # Obtener esquemas actualizados
@@ -47,6 +64,18 @@ def generate_sql_with_openai(question: str) -> str:
         print(f"bank_columns: {bank_columns}")
         print(f"mp_columns: {mp_columns}")
 
+        # Si la misma pregunta ya se respondio con este esquema reutilizamos el SQL sin llamar a OpenAI
+        fingerprint = schema_fingerprint({
+            'bank_payments': bank_columns,
+            'mp_data': mp_columns,
+            'carrefour_data': market_tickets_columns,
+            'prompt': PROMPT_VERSION
+        })
+        cached_sql = sql_cache.get(question, fingerprint)
+        if cached_sql:
+            print(f"⚡ SQL desde cache {sql_cache.stats}: {cached_sql}")
+            return cached_sql, fingerprint, True
+
         # Prompt para generar SQL
         prompt = f"""
         Eres un experto en SQL y análisis de datos. Necesito que generes una consulta SQL para responder a esta pregunta: "{question}"
@@ -56,14 +85,20 @@ def generate_sql_with_openai(question: str) -> str:
         - mp_data: {', '.join(mp_columns)}
         - carrefour_data: {', '.join(market_tickets_columns)}
 
+        Tablas de resumen (pre-agregadas, ya tienen las fechas como DATE):
+        - {SUMMARY_TABLES['spend_daily_summary']}
+        - {SUMMARY_TABLES['spend_monthly_summary']}
+        Valores de fuente: 'banco' (bank_payments), 'mercado_pago' (mp_data), 'carrefour' (carrefour_data).
+
         Reglas de oro:
         1. Usa solo estas columnas y las tablas mencionadas.
         2. Genera SQL válido para Redshift.
-        3. Si la pregunta es sobre gastos del banco/santander, usa bank_payments.
-        4. Si la pregunta es sobre transacciones/pagos a traves de mercado pago, usa mp_data.
-        5. Si la pregunta es sobre gastos del supermercado/carrefour, usa carrefour_data.
-        5. Limita los resultados a máximo 20 filas.
-        6. Incluye fechas relevantes cuando sea apropiado.
+        3. Para totales, promedios o máximos por día, mes, fuente, categoría, comercio o divisa usa las tablas de resumen en lugar de agregar las tablas originales.
+        4. Si la pregunta es sobre gastos del banco/santander, usa bank_payments.
+        5. Si la pregunta es sobre transacciones/pagos a traves de mercado pago, usa mp_data.
+        6. Si la pregunta es sobre gastos del supermercado/carrefour, usa carrefour_data.
+        7. Limita los resultados a máximo 20 filas.
+        8. Incluye fechas relevantes cuando sea apropiado.
 
         Genera solo el SQL, sin explicaciones adicionales:
         """
@@ -92,14 +127,35 @@ def generate_sql_with_openai(question: str) -> str:
             sql = sql.replace('```sql', '').replace('```', '').strip()
         
         print(f"✅ SQL generado por OpenAI: {sql}")
-        return sql
+        return sql, fingerprint, False
         
     except Exception as e:
         print(f"❌ Error generando SQL con OpenAI: {e}")
-        return ""
+        return "", None, False
+
+# Funcion para actualizar el cache de SQL segun como termino la consulta: el SQL nuevo se guarda solo si corrio bien
+# en Redshift y el que fallo se borra, asi no se sigue respondiendo con una consulta rota
+def update_sql_cache(question: str, fingerprint: str, sql: str, from_cache: bool, succeeded: bool):
+    try:
+        if not succeeded:
+            sql_cache.delete(question, fingerprint)
+        elif not from_cache:
+            sql_cache.put(question, fingerprint, sql)
+    except Exception as e:
+        # Un error del cache no tiene que afectar la respuesta al usuario
+        print(f"⚠️ Error actualizando el cache de SQL: {e}")
+    print(f"📈 Cache de SQL: {sql_cache.stats}")
 
-def query_redshift(sql: str) -> str:
+def query_redshift(sql: str) -> tuple:
+    """Ejecuta el SQL en Redshift, devuelve (respuesta formateada, si la consulta se ejecuto bien)"""
     try:
+        # Si ninguna de las tablas consultadas cambio desde la ultima vez respondemos sin ir a Redshift
+        cache_key = result_cache.key_for(sql)
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            print(f"⚡ Resultado desde cache {result_cache.stats}")
+            return cached_result, True
+
         print(f"🔍 Ejecutando SQL en Redshift:\n{sql}")  # Debug
         response = redshift_data.execute_statement(
             Database='dev',
@@ -113,38 +169,25 @@ def query_redshift(sql: str) -> str:
             if status['Status'] == 'FINISHED':
                 if status['HasResultSet']:
                     results = redshift_data.get_statement_result(Id=query_id)
-                    return format_redshift_results(results)
-                return "ℹ️ No se encontraron resultados."
+                    formatted = format_redshift_results(results)
+                else:
+                    formatted = "ℹ️ No se encontraron resultados."
+                result_cache.put(cache_key, formatted)
+                return formatted, True
             elif status['Status'] == 'FAILED':
                 error_msg = f"❌ Error en Redshift:\n```\n{status['Error']}\n```\nSQL:\n```sql\n{sql}\n```"
                 print(error_msg)  # Debug en CloudWatch
-                return error_msg
+                return error_msg, False
     except Exception as e:
         error_msg = f"⚠️ Error inesperado:\n```\n{str(e)}\n```"
         print(error_msg)  # Debug
-        return error_msg
+        return error_msg, False
 
 def format_redshift_results(results: dict) -> str:
-    columns = [col['name'] for col in results['ColumnMetadata']]
-    formatted_rows = []
-    
-    for record in results['Records']:
-        row = []
-        for field in record:
-            # Manejar todos los tipos de datos de Redshift Data API
-            if 'stringValue' in field:
-                row.append(str(field['stringValue']))
-            elif 'longValue' in field:
-                row.append(str(field['longValue']))
-            elif 'doubleValue' in field:
-                row.append(str(field['doubleValue']))
-            elif 'booleanValue' in field:
-                row.append("Sí" if field['booleanValue'] else "No")
-            elif 'isNull' in field and field['isNull']:
-                row.append("NULL")
-            else:
-                row.append("?")
-        formatted_rows.append(" | ".join(row))
+    # Decodificamos por columnas segun el tipo informado en ColumnMetadata
+    decoded = decode_page(results)
+    columns = decoded.names
+    formatted_rows = [" | ".join(row) for row in to_text_rows(decoded)]
     
     return (
         "📊 *Resultados:*\n" +
@@ -156,12 +199,13 @@ def format_redshift_results(results: dict) -> str:
 # Manejo de Telegram - versión con OpenAI
 def handle_message(text: str) -> str:
     question = text
-    sql = generate_sql_with_openai(question)
+    sql, fingerprint, from_cache = generate_sql_with_openai(question)
     
     if not sql:
         return "❌ No se pudo generar la consulta SQL. Por favor, intenta con otra pregunta."
     
-    response = query_redshift(sql)
+    response, succeeded = query_redshift(sql)
+    update_sql_cache(question, fingerprint, sql, from_cache, succeeded)
 
     return f"""
         🔍 *Consulta:* {question}
@@ -192,6 +236,12 @@ def lambda_handler(event, context):
         print("== Evento recibido por Lambda ==")
         print(json.dumps(event))
 
+        # Al terminar un crawler cambia el catálogo, invalidamos el esquema cacheado
+        if event.get("source") == "aws.glue":
+            version = invalidate_catalog()
+            print(f"♻️ Catálogo de Glue invalidado por fin de crawler (version {version})")
+            return {"statusCode": 200}
+
         data = json.loads(event["body"])
         text = data["message"]["text"]
         chat_id = data["message"]["chat"]["id"]
@@ -0,0 +1,80 @@
+# Decodificador columnar de los resultados de la Data API de Redshift. Cada pagina de get_statement_result se
+# transpone a columnas y cada columna se decodifica con el campo que corresponde a su tipo segun ColumnMetadata
+# (longValue, doubleValue, booleanValue o stringValue), sin recorrer las claves de cada celda. Las celdas nulas
+# no traen ese campo, asi que quedan como None directamente. Sobre el resultado hay adaptadores para armar un
+# DataFrame tipado o filas de texto.
+INTEGER_TYPES = {'int2', 'int4', 'int8', 'smallint', 'integer', 'bigint'}
+FLOAT_TYPES = {'float4', 'float8', 'real', 'double precision', 'float'}
+NUMERIC_TYPES = {'numeric', 'decimal'}
+BOOLEAN_TYPES = {'bool', 'boolean'}
+DATETIME_TYPES = {'timestamp', 'timestamptz', 'date'}
+
+# Funcion para elegir el campo de la celda que trae el valor de una columna
+def value_field(type_name):
+    type_name = (type_name or '').lower()
+    if type_name in INTEGER_TYPES:
+        return 'longValue'
+    if type_name in FLOAT_TYPES:
+        return 'doubleValue'
+    if type_name in BOOLEAN_TYPES:
+        return 'booleanValue'
+    return 'stringValue'
+
+class ColumnarResult:
+    def __init__(self, names, type_names, columns):
+        self.names = names
+        self.type_names = type_names
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+# Funcion para decodificar una pagina de get_statement_result en columnas. column_metadata permite reutilizar el
+# ColumnMetadata de la primera pagina en las siguientes
+def decode_page(page, column_metadata=None):
+    column_metadata = column_metadata or page['ColumnMetadata']
+    names = [col['name'] for col in column_metadata]
+    type_names = [col.get('typeName', '') for col in column_metadata]
+    records = page['Records']
+    if not records:
+        return ColumnarResult(names, type_names, [[] for _ in names])
+
+    columns = []
+    for type_name, cells in zip(type_names, zip(*records)):
+        field = value_field(type_name)
+        columns.append([cell.get(field) for cell in cells])
+    return ColumnarResult(names, type_names, columns)
+
+# Adaptador a DataFrame: cada columna se convierte una sola vez con un dtype acorde a su tipo de Redshift
+def to_dataframe(result):
+    import pandas as pd
+
+    data = {}
+    for name, type_name, values in zip(result.names, result.type_names, result.columns):
+        type_name = (type_name or '').lower()
+        if type_name in INTEGER_TYPES:
+            data[name] = pd.array(values, dtype='Int64')
+        elif type_name in FLOAT_TYPES:
+            data[name] = pd.array(values, dtype='float64')
+        elif type_name in NUMERIC_TYPES:
+            data[name] = pd.to_numeric(pd.Series(values, dtype='object'), errors='coerce')
+        elif type_name in BOOLEAN_TYPES:
+            data[name] = pd.array(values, dtype='boolean')
+        elif type_name in DATETIME_TYPES:
+            data[name] = pd.to_datetime(pd.Series(values, dtype='object'), errors='coerce')
+        else:
+            data[name] = pd.array(values, dtype='string')
+    return pd.DataFrame(data, columns=result.names)
+
+# Adaptador a texto: filas de strings listas para renderizar en una tabla
+def to_text_rows(result, null_text="NULL", true_text="Sí", false_text="No"):
+    text_columns = []
+    for type_name, values in zip(result.type_names, result.columns):
+        is_boolean = (type_name or '').lower() in BOOLEAN_TYPES
+        text_columns.append([
+            null_text if value is None
+            else (true_text if value else false_text) if is_boolean
+            else str(value)
+            for value in values
+        ])
+    return [list(row) for row in zip(*text_columns)]
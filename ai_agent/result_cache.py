@@ -0,0 +1,80 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import boto3
+
+# Cache de resultados de las consultas del agente. La clave es el texto del SQL mas la version de datos de cada
+# tabla que consulta, que load_data incrementa despues de cada carga. Mientras ninguna de esas tablas cambie la
+# misma consulta se responde desde memoria sin despertar a Redshift; apenas cambia una version la clave cambia y
+# el resultado viejo no se vuelve a usar. Si no se pueden leer las versiones no se usa el cache. Las consultas que
+# dependen de la fecha actual (CURRENT_DATE, GETDATE(), ...) suman el dia a la clave, asi no se reutilizan otro dia.
+DATA_VERSIONS_TABLE = os.environ.get('DATA_VERSIONS_TABLE')
+DEFAULT_MAX_ENTRIES = 128
+
+# Tablas de Redshift cuya version de datos se sigue
+VERSIONED_TABLES = ['bank_payments', 'mp_data', 'carrefour_data', 'spend_daily_summary', 'spend_monthly_summary']
+
+# Funciones de Redshift que hacen que el resultado de una consulta dependa de cuando se ejecuta
+TIME_FUNCTIONS = re.compile(r'\b(CURRENT_DATE|CURRENT_TIMESTAMP|GETDATE|SYSDATE|NOW|TIMEOFDAY)\b', re.IGNORECASE)
+
+# Funcion para detectar que tablas versionadas usa una consulta
+def tables_in_sql(sql, tables=VERSIONED_TABLES):
+    return sorted(table for table in tables if re.search(rf'\b{table}\b', sql, re.IGNORECASE))
+
+class ResultCache:
+    def __init__(self, table_name=DATA_VERSIONS_TABLE, max_entries=DEFAULT_MAX_ENTRIES, dynamodb=None):
+        self.dynamodb = (dynamodb or boto3.resource('dynamodb')) if table_name else None
+        self.table_name = table_name
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'bypass': 0}
+
+    # Funcion para leer en una sola llamada las versiones de las tablas de una consulta
+    def data_versions(self, tables):
+        if not tables:
+            return {}
+        response = self.dynamodb.batch_get_item(RequestItems={
+            self.table_name: {'Keys': [{'table_name': table} for table in tables]}
+        })
+        versions = {item['table_name']: int(item['version']) for item in response['Responses'].get(self.table_name, [])}
+        return {table: versions.get(table, 0) for table in tables}
+
+    # Devuelve la clave de cache de una consulta, o None si no se puede cachear
+    def key_for(self, sql):
+        if self.dynamodb is None:
+            return None
+        try:
+            versions = self.data_versions(tables_in_sql(sql))
+        except Exception as e:
+            print(f"⚠️ No se pudieron leer las versiones de datos, se consulta Redshift: {e}")
+            return None
+        normalized_sql = ' '.join(sql.split())
+        version_tag = ','.join(f"{table}={version}" for table, version in sorted(versions.items()))
+        if TIME_FUNCTIONS.search(sql):
+            version_tag += f"|dia={datetime.utcnow().date().isoformat()}"
+        return hashlib.sha256(f"{version_tag}|{normalized_sql}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key is None:
+                self.stats['bypass'] += 1
+                return None
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.entries[key]
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, result):
+        if key is None:
+            return
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
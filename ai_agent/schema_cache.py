@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+import boto3
+
+# Cache del catalogo de Glue del contenedor. Todas las tablas de la base se leen en una sola pasada paginada de
+# get_tables y quedan en memoria por SCHEMA_TTL_SECONDS, asi las preguntas no pagan idas y vueltas a Glue. Cuando
+# termina un crawler EventBridge invoca a la Lambda, que sube la version del catalogo en la tabla de versiones de
+# datos: cada contenedor compara esa version con la de su cache (como mucho cada VERSION_CHECK_SECONDS) y vuelve a
+# leer el catalogo apenas cambia. Si no hay tabla de versiones o no se puede leer, queda solo el TTL.
+SCHEMA_TTL_SECONDS = int(os.environ.get('SCHEMA_TTL_SECONDS', 60 * 60))
+VERSION_CHECK_SECONDS = int(os.environ.get('CATALOG_VERSION_CHECK_SECONDS', 10))
+DATA_VERSIONS_TABLE = os.environ.get('DATA_VERSIONS_TABLE')
+CATALOG_VERSION_KEY = 'glue_catalog'
+
+_lock = threading.Lock()
+_catalogs = {}
+_version = {'value': None, 'checked_at': None}
+_table = None
+
+def _get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(DATA_VERSIONS_TABLE)
+    return _table
+
+# Funcion para leer la version actual del catalogo, se consulta a DynamoDB como mucho cada VERSION_CHECK_SECONDS
+def current_catalog_version():
+    if not DATA_VERSIONS_TABLE:
+        return None
+    now = time.monotonic()
+    if _version['checked_at'] is not None and now - _version['checked_at'] < VERSION_CHECK_SECONDS:
+        return _version['value']
+    try:
+        item = _get_table().get_item(Key={'table_name': CATALOG_VERSION_KEY}).get('Item')
+    except Exception as e:
+        print(f"⚠️ No se pudo leer la version del catalogo, se usa el TTL: {e}")
+        return _version['value']
+    _version['value'] = int(item['version']) if item else 0
+    _version['checked_at'] = now
+    return _version['value']
+
+# Funcion para subir la version del catalogo al terminar un crawler, invalida el cache de todos los contenedores
+def bump_catalog_version():
+    if not DATA_VERSIONS_TABLE:
+        return None
+    response = _get_table().update_item(
+        Key={'table_name': CATALOG_VERSION_KEY},
+        UpdateExpression='ADD version :one SET updated_at = :now',
+        ExpressionAttributeValues={':one': 1, ':now': int(time.time())},
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['version'])
+
+# Funcion para leer todas las tablas de una base de Glue en una sola pasada: {tabla: [columnas]}
+def load_catalog(glue_client, database):
+    tables = {}
+    paginator = glue_client.get_paginator('get_tables')
+    for page in paginator.paginate(DatabaseName=database):
+        for table in page['TableList']:
+            tables[table['Name']] = [col['Name'] for col in table['StorageDescriptor']['Columns']]
+    return tables
+
+# Funcion para obtener el catalogo cacheado de una base, lo vuelve a leer si vencio el TTL o cambio la version
+def get_catalog(glue_client, database, ttl=SCHEMA_TTL_SECONDS):
+    with _lock:
+        version = current_catalog_version()
+        cached = _catalogs.get(database)
+        if cached is not None and cached[1] > time.monotonic() and cached[2] == version:
+            return cached[0]
+
+        tables = load_catalog(glue_client, database)
+        _catalogs[database] = (tables, time.monotonic() + ttl, version)
+        print(f"📚 Catalogo de {database} cargado: {len(tables)} tablas")
+        return tables
+
+# Funcion para invalidar el cache al terminar un crawler: sube la version compartida para los demas contenedores y
+# limpia el cache local. Sin base se invalida todo
+def invalidate_catalog(database=None):
+    version = bump_catalog_version()
+    with _lock:
+        _version['value'], _version['checked_at'] = version, (time.monotonic() if version is not None else None)
+        if database is None:
+            _catalogs.clear()
+        else:
+            _catalogs.pop(database, None)
+    return version
+
+# Funcion para buscar en el catalogo la primera tabla con un prefijo (en orden alfabetico, como get_tables)
+def find_table_columns(catalog, table_prefix):
+    for table_name in sorted(catalog):
+        if table_name.startswith(table_prefix):
+            return table_name, catalog[table_name]
+    return None, []
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+import boto3
+from botocore.exceptions import ClientError
+
+# Cache pregunta -> SQL del agente. La clave es la pregunta normalizada (sin mayusculas, tildes ni signos) mas una
+# huella del esquema con el que se genero el SQL: si un crawler cambia las columnas cambia la huella y las entradas
+# viejas dejan de usarse solas. Hay un LRU acotado en memoria delante de una tabla de DynamoDB que persiste entre
+# contenedores; en DynamoDB la expulsion es por TTL. El agente guarda un SQL recien despues de que corrio bien en
+# Redshift y borra el que falla. Si el SQL generado trae fechas literales (el modelo puede resolver "este mes" a
+# '2025-06-01') puede depender del dia en que se hizo la pregunta, asi que esa entrada solo se reutiliza ese dia.
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+LITERAL_DATE = re.compile(r"'(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{2,4})")
+
+# Funcion para normalizar una pregunta: "¿Cuánto gasté este mes?" y "cuanto gaste este mes" dan la misma clave
+def normalize_question(question):
+    text = unicodedata.normalize('NFKD', question.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+# Funcion para calcular la huella del esquema a partir de las columnas de cada tabla
+def schema_fingerprint(schema):
+    payload = json.dumps(schema, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def cache_key(question, fingerprint):
+    return f"{fingerprint}:{normalize_question(question)}"
+
+def today():
+    return datetime.utcnow().date().isoformat()
+
+# Dia en que vale un SQL: el de hoy si tiene fechas literales, None si vale siempre
+def valid_on(sql):
+    return today() if LITERAL_DATE.search(sql) else None
+
+class SqlCache:
+    def __init__(self, table_name=None, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, dynamodb=None):
+        self.table = (dynamodb or boto3.resource('dynamodb')).Table(table_name) if table_name else None
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _remember(self, key, sql, sql_valid_on=None):
+        with self.lock:
+            self.entries[key] = (sql, sql_valid_on)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get(self, question, fingerprint):
+        key = cache_key(question, fingerprint)
+        with self.lock:
+            if key in self.entries and self.entries[key][1] in (None, today()):
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.entries[key][0]
+
+        if self.table is not None:
+            try:
+                # Cuenta el hit en la tabla y devuelve el item en la misma llamada; si no existe, vencio o es de
+                # otro dia falla la condicion
+                item = self.table.update_item(
+                    Key={'cache_key': key},
+                    UpdateExpression='ADD hits :one',
+                    ConditionExpression='attribute_exists(cache_key) AND expires_at > :now AND '
+                                        '(attribute_not_exists(valid_on) OR valid_on = :today)',
+                    ExpressionAttributeValues={':one': 1, ':now': int(time.time()), ':today': today()},
+                    ReturnValues='ALL_NEW'
+                )['Attributes']
+                self._remember(key, item['sql'], item.get('valid_on'))
+                self._count('hits')
+                return item['sql']
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    print(f"⚠️ Error leyendo el cache de SQL: {e}")
+
+        self._count('misses')
+        return None
+
+    def put(self, question, fingerprint, sql):
+        key = cache_key(question, fingerprint)
+        sql_valid_on = valid_on(sql)
+        self._remember(key, sql, sql_valid_on)
+        if self.table is not None:
+            now = int(time.time())
+            item = {
+                'cache_key': key,
+                'question': normalize_question(question),
+                'sql': sql,
+                'hits': 0,
+                'created_at': now,
+                'expires_at': now + self.ttl_seconds
+            }
+            if sql_valid_on is not None:
+                item['valid_on'] = sql_valid_on
+            self.table.put_item(Item=item)
+
+    # Borra una entrada de los dos niveles, se usa cuando el SQL cacheado fallo en Redshift
+    def delete(self, question, fingerprint):
+        key = cache_key(question, fingerprint)
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.table is not None:
+            self.table.delete_item(Key={'cache_key': key})
+
+# Funcion para armar el cache segun la configuracion de la Lambda, sin tabla queda solo el LRU del contenedor
+def build_sql_cache(table_name=None, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+    if not table_name:
+        print("⚠️ Sin tabla de cache de SQL configurada, se usa solo el cache en memoria del contenedor.")
+    return SqlCache(table_name, max_entries, ttl_seconds)
@@ -0,0 +1,111 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+import boto3
+from boto3.dynamodb.conditions import Key
+
+# Registro de fallas de los flujos ETL. Cada falla se guarda en la particion "<flujo>#<fecha>" con una sort key
+# ordenada por tiempo ("<timestamp ISO>#<sufijo>"), asi las fallas de un flujo en un rango de dias se obtienen con
+# una query por dia en lugar de un scan de toda la tabla. Los items expiran por TTL sobre expires_at.
+DEFAULT_TTL_DAYS = 90
+
+def partition_key(flow, day):
+    return f"{flow}#{day.strftime('%Y-%m-%d')}"
+
+# Funcion para armar el item de una falla, compartida por el ledger de DynamoDB y el de memoria
+def build_failure_item(flow, error_detail, file_ids=None, at=None, ttl_days=DEFAULT_TTL_DAYS):
+    at = at or datetime.utcnow()
+    return {
+        'pk': partition_key(flow, at),
+        'sk': f"{at.isoformat()}#{uuid.uuid4().hex[:8]}",
+        'flow': flow,
+        'error_detail': error_detail,
+        'file_ids': list(file_ids or []),
+        'timestamp': at.isoformat(),
+        'expires_at': int((at + timedelta(days=ttl_days)).timestamp())
+    }
+
+# Funcion para listar los dias (particiones) que cubre una consulta de los ultimos N dias
+def days_back(days, now=None):
+    now = now or datetime.utcnow()
+    return [now - timedelta(days=i) for i in range(days)]
+
+# Ledger productivo sobre DynamoDB. Las fallas se acumulan con record() y se escriben en lote con flush()
+class DynamoFailureLedger:
+    def __init__(self, table_name, ttl_days=DEFAULT_TTL_DAYS, dynamodb=None):
+        self.table = (dynamodb or boto3.resource('dynamodb')).Table(table_name)
+        self.ttl_days = ttl_days
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def record(self, flow, error_detail, file_ids=None, at=None):
+        item = build_failure_item(flow, error_detail, file_ids, at, self.ttl_days)
+        with self.lock:
+            self.pending.append(item)
+        return item
+
+    def flush(self):
+        with self.lock:
+            items, self.pending = self.pending, []
+        if not items:
+            return 0
+        # batch_writer agrupa en BatchWriteItem de hasta 25 items y reintenta los no procesados
+        with self.table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+        return len(items)
+
+    # Fallas de un flujo en los ultimos N dias, de la mas reciente a la mas vieja
+    def failures(self, flow, days=7, now=None):
+        items = []
+        for day in days_back(days, now):
+            query = {'KeyConditionExpression': Key('pk').eq(partition_key(flow, day)), 'ScanIndexForward': False}
+            while True:
+                response = self.table.query(**query)
+                items.extend(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return items
+
+    # Fallas que involucraron un archivo, buscando en las particiones del flujo de los ultimos N dias
+    def failures_for_file(self, flow, file_id, days=7, now=None):
+        return [item for item in self.failures(flow, days, now) if file_id in item.get('file_ids', [])]
+
+# Ledger en memoria con la misma interfaz, para pruebas locales o cuando no hay tabla configurada
+class InMemoryFailureLedger:
+    def __init__(self, ttl_days=DEFAULT_TTL_DAYS):
+        self.ttl_days = ttl_days
+        self.lock = threading.Lock()
+        self.pending = []
+        self.items = {}
+
+    def record(self, flow, error_detail, file_ids=None, at=None):
+        item = build_failure_item(flow, error_detail, file_ids, at, self.ttl_days)
+        with self.lock:
+            self.pending.append(item)
+        return item
+
+    def flush(self):
+        with self.lock:
+            items, self.pending = self.pending, []
+            for item in items:
+                self.items.setdefault(item['pk'], []).append(item)
+        return len(items)
+
+    def failures(self, flow, days=7, now=None):
+        items = []
+        with self.lock:
+            for day in days_back(days, now):
+                items.extend(sorted(self.items.get(partition_key(flow, day), []), key=lambda item: item['sk'], reverse=True))
+        return items
+
+    def failures_for_file(self, flow, file_id, days=7, now=None):
+        return [item for item in self.failures(flow, days, now) if file_id in item.get('file_ids', [])]
+
+# Funcion para elegir el ledger segun la configuracion de la Lambda
+def build_failure_ledger(table_name=None, ttl_days=DEFAULT_TTL_DAYS):
+    if table_name:
+        return DynamoFailureLedger(table_name, ttl_days)
+    print("⚠️ Sin tabla de fallas configurada, se usa un ledger en memoria del contenedor.")
+    return InMemoryFailureLedger(ttl_days)
@@ -2,8 +2,9 @@ import json
 import boto3
 import logging
 import os
-import psycopg2
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from failure_ledger import build_failure_ledger, DEFAULT_TTL_DAYS
 
 # Importamos las variables del github secrets
 aws_region = os.environ["AWS_REGION"]
@@ -16,47 +17,127 @@ SNS_TOPIC_ARN = f'arn:aws:sns:{aws_region}:{aws_account_id}:etl_alerts'
 
 # Iniciamos los servicios de AWS para realizar las operaciones de compensacion
 s3_client = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-
-# Funcion para registrar los errores que hayan ocurrido en el flujo
-def log_failure_to_dynamo(table_name, error_detail):
-    table = dynamodb.Table(table_name)
-    table.put_item(
-        Item={
-            'error_id': str(datetime.utcnow().timestamp()),
-            'error_detail': error_detail,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-    )
-    logger.info("Failure logged in DynamoDB.")
+redshift_data = boto3.client('redshift-data')
+
+DATABASE = 'dev'
+WORKGROUP_NAME = os.environ.get('WORKGROUP_NAME', 'pdf-etl-workgroup')
+CONTROL_TABLE = os.environ.get('CONTROL_TABLE', 'etl_file_control')
+
+# Registro de fallas consultable por flujo y fecha
+failure_ledger = build_failure_ledger(
+    os.environ.get('FAILURE_LEDGER_TABLE'),
+    int(os.environ.get('FAILURE_LEDGER_TTL_DAYS', DEFAULT_TTL_DAYS))
+)
+
+DELETE_BATCH_SIZE = 1000  # Maximo de claves que acepta S3 en un delete_objects
+CLEANUP_WORKERS = 4
+PROTECTED_PREFIX = 'state/'  # Estado de los extractores (indices, marcas de agua), nunca se borra en una limpieza
+
+# Funcion para registrar un error del flujo en el ledger de fallas. Solo se acumula: todas las fallas de la corrida de
+# compensacion (la original y las de la propia compensacion) se escriben juntas con flush_failures al final
+def log_failure(flow, error_detail, file_ids):
+    failure_ledger.record(flow, error_detail, file_ids)
 
-# Funcion para rollbackear las modificaciones que se hayan hecho en la tabla de Redshift
-def rollback_redshift(redshift_params, control_table, file_id):
+def flush_failures(flow):
+    written = failure_ledger.flush()
+    logger.info(f"{written} failure(s) logged in the failure ledger for {flow}.")
+
+# Funcion para esperar a que termine una sentencia de la Data API de Redshift
+def wait_for_statement(statement_id):
+    while True:
+        desc = redshift_data.describe_statement(Id=statement_id)
+        if desc['Status'] in ('FINISHED', 'FAILED', 'ABORTED'):
+            return desc
+        time.sleep(0.5)
+
+# Funcion para obtener los archivos afectados por la falla a partir del input del step que fallo
+def affected_file_ids(event):
+    file_ids = list(event.get('file_ids', []))
+    body = event.get('body')
+    if isinstance(body, dict) and body.get('key'):
+        file_ids.append(body['key'])
+    return sorted(set(file_ids))
+
+# Funcion para rollbackear las modificaciones que se hayan hecho en la tabla de Redshift. Todos los archivos de la
+# corrida se marcan con un solo UPDATE ... WHERE file_id IN (...) parametrizado en la Data API, sin abrir conexiones.
+# Si el rollback falla queda registrado en el ledger y se devuelve el error, para no confundirlo con "nada que revertir"
+def rollback_redshift(flow, control_table, file_ids):
+    if not file_ids:
+        return {'files': 0, 'error': None}
+
+    placeholders = ', '.join(f':file_id_{i}' for i in range(len(file_ids)))
+    parameters = [{'name': f'file_id_{i}', 'value': file_id} for i, file_id in enumerate(file_ids)]
     try:
-        conn = psycopg2.connect(**redshift_params)
-        cur = conn.cursor()
-        # Ejemplo: marcar como fallido
-        cur.execute(f"UPDATE {control_table} SET status='FAILED' WHERE file_id = %s", (file_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
-        logger.info("Rollback in Redshift completed successfully.")
+        response = redshift_data.execute_statement(
+            Database=DATABASE,
+            WorkgroupName=WORKGROUP_NAME,
+            Sql=f"UPDATE {control_table} SET status='FAILED', updated_at=GETDATE() WHERE file_id IN ({placeholders})",
+            Parameters=parameters
+        )
+        desc = wait_for_statement(response['Id'])
+        if desc['Status'] != 'FINISHED':
+            raise Exception(desc.get('Error'))
+        logger.info(f"Rollback in Redshift completed successfully: {desc.get('ResultRows', 0)} rows marked as FAILED for {len(file_ids)} files.")
+        return {'files': len(file_ids), 'error': None}
     except Exception as e:
         logger.error(f"Error during rollback: {str(e)}")
+        log_failure(flow, json.dumps({'rollback_error': str(e)}), file_ids)
+        return {'files': 0, 'error': str(e)}
 
-# Funcion para borrar archivos temporales de S3 que no se terminaron de ingestar o convertir por falla en el flujo
+# Funcion para borrar un lote de hasta 1000 claves con un solo delete_objects, devuelve (borrados, fallidos)
+def delete_s3_batch(bucket_name, keys):
+    try:
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except Exception as e:
+        logger.error(f"Error deleting batch of {len(keys)} objects from {bucket_name}: {str(e)}")
+        return 0, len(keys)
+
+    # En modo Quiet S3 solo informa las claves que no pudo borrar
+    errors = response.get('Errors', [])
+    for error in errors:
+        logger.error(f"Could not delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+    return len(keys) - len(errors), len(errors)
+
+# Funcion para borrar archivos temporales de S3 que no se terminaron de ingestar o convertir por falla en el flujo.
+# Recorre todas las paginas del prefijo y borra cada pagina como un lote de delete_objects en un pool de workers,
+# asi la cantidad de llamadas depende de las paginas y no de los objetos. Devuelve los conteos de la limpieza
 def cleanup_s3_temp_files(bucket_name, prefix):
     logger.info(f"Cleaning up temp files in {bucket_name}/{prefix}")
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-    if 'Contents' in response:
-        for obj in response['Contents']:
-            s3_client.delete_object(Bucket=bucket_name, Key=obj['Key'])
-            logger.info(f"Deleted {obj['Key']}")
-    else:
+    result = {'deleted': 0, 'failed': 0, 'skipped': 0}
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+        futures = []
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, PaginationConfig={'PageSize': DELETE_BATCH_SIZE}):
+            keys = []
+            for obj in page.get('Contents', []):
+                # Los marcadores de carpeta y el estado de los extractores no son archivos temporales
+                if obj['Key'].endswith('/') or obj['Key'].startswith(PROTECTED_PREFIX):
+                    result['skipped'] += 1
+                    continue
+                keys.append(obj['Key'])
+
+            for i in range(0, len(keys), DELETE_BATCH_SIZE):
+                futures.append(executor.submit(delete_s3_batch, bucket_name, keys[i:i + DELETE_BATCH_SIZE]))
+
+        for future in futures:
+            deleted, failed = future.result()
+            result['deleted'] += deleted
+            result['failed'] += failed
+
+    if not futures:
         logger.info("No temporary files found to delete.")
+    logger.info(f"Cleanup of {bucket_name}/{prefix} finished: {result}")
+    return result
 
 def lambda_handler(event, context):
     logger.info("Compensation flow triggered due to failure in ETL process.")
+    # Las Step Functions envian el input del step que fallo en payload junto con el nombre del flujo
+    flow = event.get('flow', 'unknown')
+    event = event.get('payload', event)
     error_detail = json.dumps(event.get('error-info', {}))
     logger.error(f"Compensation triggered due to: {error_detail}")
     
@@ -67,15 +148,25 @@ def lambda_handler(event, context):
         Message=f"Fallo en proceso ETL. Detalle: {error_detail}"
     )
     
-    # # Segun el tipo de error ejecutamos una funcion especifica de compensacion
-    # if 'GmailDownloadError' in error_detail:
-    #     cleanup_s3_temp_files(bucket_name, prefix)
-    # elif 'RedshiftUploadError' in error_detail:
-    #     rollback_redshift(redshift_params, control_table, file_id)
-    # else:
-    #     log_failure_to_dynamo(table_name, error_detail)
+    file_ids = affected_file_ids(event)
+    log_failure(flow, error_detail, file_ids)
+    try:
+        # Marcamos como fallidos en la tabla de control todos los archivos que toco la corrida
+        rollback = rollback_redshift(flow, CONTROL_TABLE, file_ids)
 
+        # # Segun el tipo de error ejecutamos una funcion especifica de compensacion
+        # if 'GmailDownloadError' in error_detail:
+        #     cleanup_s3_temp_files(bucket_name, prefix)
+    finally:
+        # Una sola escritura en lote con todas las fallas registradas en la corrida
+        flush_failures(flow)
+
+    if rollback['error']:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': f"Rollback in Redshift failed: {rollback['error']}", 'file_ids': file_ids})
+        }
     return {
         'statusCode': 200,
-        'body': json.dumps('Compensation flow executed successfully.')
+        'body': json.dumps({'message': 'Compensation flow executed successfully.', 'rolled_back_files': rollback['files']})
     }
\ No newline at end of file
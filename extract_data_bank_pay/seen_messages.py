@@ -0,0 +1,51 @@
+from array import array
+from botocore.exceptions import ClientError
+
+# Indice de los ids de mensajes de Gmail ya extraidos. Se guarda en S3 como un array ordenado de enteros
+# de 64 bits (los ids de Gmail son hexadecimales de 16 caracteres), 8 bytes por mensaje, y se carga en un
+# set para chequear en O(1) antes de hacer el messages.get de cada mail.
+SEEN_INDEX_KEY = 'state/seen_message_ids.bin'
+
+def message_id_to_int(msg_id):
+    try:
+        value = int(msg_id, 16)
+    except (TypeError, ValueError):
+        return None
+    if value >= 2 ** 64:
+        return None
+    return value
+
+# Funcion para cargar el indice desde S3, si todavia no existe devolvemos un indice vacio
+def load_seen_index(s3_client, bucket_name, key=SEEN_INDEX_KEY):
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            print("ℹ️ No existe indice de mensajes procesados, se crea uno nuevo.")
+            return set()
+        raise
+
+    snapshot = array('Q')
+    snapshot.frombytes(response['Body'].read())
+    print(f"📚 Indice de mensajes procesados cargado: {len(snapshot)} ids")
+    return set(snapshot)
+
+def is_seen(seen_index, msg_id):
+    value = message_id_to_int(msg_id)
+    return value is not None and value in seen_index
+
+def mark_seen(seen_index, msg_id):
+    value = message_id_to_int(msg_id)
+    if value is not None:
+        seen_index.add(value)
+
+# Funcion para persistir el indice en S3 como snapshot ordenado
+def save_seen_index(s3_client, seen_index, bucket_name, key=SEEN_INDEX_KEY):
+    snapshot = array('Q', sorted(seen_index))
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=snapshot.tobytes(),
+        ContentType='application/octet-stream'
+    )
+    print(f"💾 Indice de mensajes procesados actualizado: {len(snapshot)} ids")
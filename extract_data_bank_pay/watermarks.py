@@ -0,0 +1,44 @@
+import json
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+# Marcas de agua de ingesta por dataset: la ultima fecha cargada con exito en Redshift. Las avanza load_data
+# despues de cada carga confirmada y los extractores la leen con un unico get_object, en lugar de calcular
+# MAX(fecha) sobre toda la tabla. Se guardan en el bucket de cada dataset bajo state/watermarks/.
+WATERMARK_PREFIX = 'state/watermarks/'
+
+def watermark_key(dataset):
+    return f"{WATERMARK_PREFIX}{dataset}.json"
+
+# Funcion para leer la marca de agua de un dataset, devuelve None si todavia no existe
+def read_watermark(s3_client, bucket_name, dataset):
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=watermark_key(dataset))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    state = json.loads(response['Body'].read())
+    return datetime.strptime(state['watermark'], '%Y-%m-%d')
+
+# Funcion para avanzar la marca de agua de un dataset, nunca retrocede
+def advance_watermark(s3_client, bucket_name, dataset, new_watermark):
+    new_watermark = datetime.strptime(new_watermark.strftime('%Y-%m-%d'), '%Y-%m-%d')
+    current_watermark = read_watermark(s3_client, bucket_name, dataset)
+    if current_watermark is not None and new_watermark <= current_watermark:
+        return current_watermark
+
+    state = {
+        'dataset': dataset,
+        'watermark': new_watermark.strftime('%Y-%m-%d'),
+        'updated_at': datetime.utcnow().isoformat()
+    }
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=watermark_key(dataset),
+        Body=json.dumps(state),
+        ContentType='application/json'
+    )
+    print(f"📌 Marca de agua de {dataset} avanzada a {state['watermark']}")
+    return new_watermark
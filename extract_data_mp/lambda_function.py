@@ -1,24 +1,39 @@
 import json
+import os
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.exceptions import ClientError
 from datetime import datetime, timedelta
 import pandas as pd
+from s3_streaming import stream_response_to_s3
+from credentials_cache import get_parameter
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 
+# Presupuesto de llamados a la API de Mercado Pago y parametros de descarga de los reportes
+MP_MAX_REQUESTS_PER_SECOND = float(os.environ.get('MP_MAX_REQUESTS_PER_SECOND', '5'))
+MP_DOWNLOAD_WORKERS = int(os.environ.get('MP_DOWNLOAD_WORKERS', '4'))
+MP_MAX_RETRIES = int(os.environ.get('MP_MAX_RETRIES', '4'))
+MP_BACKOFF_SECONDS = 1.0
+MP_TIMEOUT = (5, 60)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
 # Funciona para obtener parametro de parameter store de AWS que contiene el access token a la API de Mercado Pago
+# El valor queda cacheado en el contenedor, asi las invocaciones en caliente no vuelven a llamar a SSM
 def auth_mp():
-    # Cliente AWS SSM para Parameter Store
-    ssm_client = boto3.client("ssm", region_name="us-east-2")
     PARAMETER_NAME = "/mercado_pago/token"
 
     # Obtener el parámetro desde AWS Parameter Store
     try:
-        response = ssm_client.get_parameter(Name=PARAMETER_NAME, WithDecryption=True)
-        access_token = response["Parameter"]["Value"]
-        return access_token
-    except ssm_client.exceptions.ParameterNotFound:
-        raise Exception(f"El parámetro {PARAMETER_NAME} no existe en AWS Parameter Store.")
+        return get_parameter(PARAMETER_NAME)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ParameterNotFound':
+            raise Exception(f"El parámetro {PARAMETER_NAME} no existe en AWS Parameter Store.")
+        raise
 
 # En caso de que se modifique la frecuencia de creacion automatica de reportes desde MP, leemos esa frecuencia y ajustamos EventBridge
 def get_report_frequency(access_token):
@@ -31,12 +46,57 @@ def get_report_frequency(access_token):
     file_name_prefix = response["file_name_prefix"]
     return horizonte_temporal, fecha_ejecucion, file_name_prefix
 
+# Limitador de llamados por segundo compartido entre los workers, reparte turnos espaciados de forma uniforme
+class RateLimiter:
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+# Sesion HTTP compartida (keep-alive) autenticada contra la API de Mercado Pago
+def build_mp_session(access_token, pool_size=MP_DOWNLOAD_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.headers.update({'Authorization': 'Bearer ' + access_token})
+    return session
+
+# Funcion para hacer un GET a la API de Mercado Pago respetando el presupuesto de llamados y reintentando 429/5xx con backoff
+def mp_get(session, rate_limiter, url, stream=False):
+    for intento in range(MP_MAX_RETRIES + 1):
+        rate_limiter.wait()
+        try:
+            response = session.get(url, timeout=MP_TIMEOUT, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if intento == MP_MAX_RETRIES:
+                raise
+            espera = MP_BACKOFF_SECONDS * 2 ** intento
+            print(f"♻️ Error de red en {url} ({e}), reintento en {espera:.1f}s")
+            time.sleep(espera)
+            continue
+
+        if response.status_code not in RETRYABLE_STATUS or intento == MP_MAX_RETRIES:
+            response.raise_for_status()
+            return response
+
+        # Si la API indica cuanto esperar (Retry-After) lo respetamos, sino backoff exponencial
+        retry_after = response.headers.get('Retry-After', '')
+        espera = float(retry_after) if retry_after.isdigit() else MP_BACKOFF_SECONDS * 2 ** intento
+        response.close()
+        print(f"♻️ Respuesta {response.status_code} de {url}, reintento en {espera:.1f}s")
+        time.sleep(espera)
+
 # Funcion para obtener una lista de los reportes de Mercado Pago 
-def get_reports(access_token):
+def get_reports(session, rate_limiter):
     url = "https://api.mercadopago.com/v1/account/settlement_report/list"
-    payload = {}
-    headers = {'Authorization': 'Bearer ' + access_token}
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = mp_get(session, rate_limiter, url)
     return response.json()
 
 # Funcion para convertir objeto pdf a dataframe
@@ -55,33 +115,57 @@ def format_string_io_to_df(reader):
 
     return report_df
 
-# Funcion para guardar el reporte de Mercado Pago en un bucket de S3
-def save_report_to_s3(report_file_name, access_token, s3_client, bucket_name, key, file_format, report_id, report_date):
+# Content types de los formatos de reporte que soportamos
+REPORT_CONTENT_TYPES = {
+    'CSV': 'text/csv',
+    'XLSX': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+# Funcion para guardar el reporte de Mercado Pago en un bucket de S3, el contenido se sube en streaming sin cargarlo entero en memoria
+def save_report_to_s3(report_file_name, session, rate_limiter, s3_client, bucket_name, key, file_format, report_id, report_date):
+    if file_format not in REPORT_CONTENT_TYPES:
+        raise ValueError("Reporte no subido")
+
     url = f"https://api.mercadopago.com/v1/account/settlement_report/{report_file_name}"
-    payload = {}
-    headers = {'Authorization': 'Bearer ' + access_token}
-    response = requests.get(url, headers=headers, data=payload)
-    response.raise_for_status()
-
-    if file_format == 'CSV':
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=key,
-            Body=response.text.encode('utf-8'),
-            ContentType='text/csv'
-        )
-        print(f'Reporte {report_id} de fecha {report_date}, subido a S3')
-    elif file_format == 'XLSX':
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=key,
-            Body=response.content,
-            ContentType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    with mp_get(session, rate_limiter, url, stream=True) as response:
+        stream_response_to_s3(response, s3_client, bucket_name, key, REPORT_CONTENT_TYPES[file_format])
+    print(f'Reporte {report_id} de fecha {report_date}, subido a S3')
+
+# Funcion que descarga un reporte y mide su latencia, los errores se devuelven para no cortar al resto de las descargas
+def download_report(pending_report, session, rate_limiter, s3_client, bucket_name):
+    inicio = time.monotonic()
+    error = None
+    try:
+        save_report_to_s3(
+            pending_report['report_file_name'], session, rate_limiter, s3_client, bucket_name,
+            pending_report['s3_key'], pending_report['file_format'], pending_report['report_id'], pending_report['report_date']
         )
-        print(f'Reporte {report_id} de fecha {report_date}, subido a S3')
-    else:
-        raise ValueError("Reporte no subido")
-    
+    except Exception as e:
+        error = str(e)
+    latencia = time.monotonic() - inicio
+    estado = '✅' if error is None else f'❌ {error}'
+    print(f"⏱️ Reporte {pending_report['report_id']}: {latencia:.2f}s {estado}")
+    return pending_report['report_id'], error, latencia
+
+# Funcion para descargar en paralelo los reportes pendientes. Devuelve los ids subidos y los errores por reporte
+def download_reports(pending_reports, session, rate_limiter, s3_client, bucket_name):
+    descargados, errores = [], {}
+    if not pending_reports:
+        return descargados, errores
+
+    with ThreadPoolExecutor(max_workers=MP_DOWNLOAD_WORKERS) as executor:
+        futures = [
+            executor.submit(download_report, pending_report, session, rate_limiter, s3_client, bucket_name)
+            for pending_report in pending_reports
+        ]
+        for future in as_completed(futures):
+            report_id, error, latencia = future.result()
+            if error is None:
+                descargados.append(report_id)
+            else:
+                errores[report_id] = error
+    return descargados, errores
+
 def format_report_file_name(s3_filename):
     base = s3_filename.rsplit('_', 1)[0]
     extension = s3_filename.split('.')[-1]
@@ -94,54 +178,181 @@ def format_report_file_name(s3_filename):
 
     return report_file_name, report_id, report_date
 
+# Manifiesto con los ids y nombres de archivo originales de los reportes ya extraidos a S3, se actualiza en cada subida
+# para no tener que listar todo el bucket. Guardamos ambos porque el webhook informa el nombre del archivo pero no su id
+REPORT_INDEX_KEY = 'state/extracted_report_ids.json'
+
+# Nombre original del reporte en Mercado Pago a partir del nombre con el que se guardo en S3 ({nombre}_{fecha}_{id}.{ext})
+def original_report_file_name(s3_filename):
+    extension = s3_filename.split('.')[-1]
+    return f"{s3_filename.rsplit('_', 2)[0]}.{extension}"
+
+# Funcion para reconstruir el indice de reportes a partir de los archivos del bucket (solo si no existe el manifiesto)
+def build_report_index(s3_client, bucket_name, folder):
+    report_ids = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=folder):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.csv') or obj['Key'].endswith('.xlsx'):
+                s3_filename = obj['Key'].split('/')[-1]
+                s3_report_file_name, s3_report_id, report_date = format_report_file_name(s3_filename)
+                report_ids.add(s3_report_id)
+                report_ids.add(original_report_file_name(s3_filename))
+    return report_ids
+
+def save_report_index(s3_client, bucket_name, report_ids):
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=REPORT_INDEX_KEY,
+        Body=json.dumps(sorted(report_ids)),
+        ContentType='application/json'
+    )
+
+# Funcion para obtener los ids de los reportes ya ingestados en S3 con una sola lectura del manifiesto
+def load_report_index(s3_client, bucket_name, folder):
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=REPORT_INDEX_KEY)
+        return set(json.loads(response['Body'].read()))
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+
+    print("ℹ️ No existe el manifiesto de reportes, se reconstruye desde el bucket.")
+    report_ids = build_report_index(s3_client, bucket_name, folder)
+    save_report_index(s3_client, bucket_name, report_ids)
+    return report_ids
+
+# Fecha que cubre un reporte programado: el end_date informado por Mercado Pago menos un dia
+def report_last_date(end_date):
+    last_report_date = datetime.strptime(end_date, '%Y-%m-%dT%H:%M:%SZ')
+    last_report_date -= timedelta(days=1)
+    return last_report_date.strftime('%Y-%m-%d')
+
 # (MODIFICAR POR EL WEBHOOK) Funcion que extrae los reportes de la lista de reportes y analiza cual es el ultimo a ingestar en Redshift
 def extract_mercado_pago_reports():    
     access_token = auth_mp()
-    reportes = get_reports(access_token)
+    rate_limiter = RateLimiter(MP_MAX_REQUESTS_PER_SECOND)
+    session = build_mp_session(access_token)
+    reportes = get_reports(session, rate_limiter)
+
+    # Obtenemos una sola vez los ids de los reportes ya ingestados en S3
+    s3_client = boto3.client('s3')
+    bucket_name = 'mercadopago-reports'
+    folder = 'raw/'
+    set_s3_reports_extracted = load_report_index(s3_client, bucket_name, folder)
 
     # Reportes ya viene ordenado de fecha mas reciente a fecha mas antigua de creacion
-    set_s3_reports_extracted = set()
+    pending_reports = []
     for reporte in reportes:
         created_from = reporte.get("created_from", None)
         if created_from == 'schedule':
-            report_date = reporte.get("end_date", None) # 2025-06-09T02:59:59Z
-            last_report_date = datetime.strptime(report_date, '%Y-%m-%dT%H:%M:%SZ')
-            last_report_date -= timedelta(days=1)
-            last_report_date = last_report_date.strftime('%Y-%m-%d')            
+            last_report_date = report_last_date(reporte.get("end_date", None)) # 2025-06-09T02:59:59Z
             report_file_name = reporte.get("file_name", None)
             file_format = reporte.get("format", None)
             report_id = reporte.get("id", None)
-            
-            # Obtenemos los ids de los reportes ya ingestados en S3       
-            s3_client = boto3.client('s3')
-            bucket_name = 'mercadopago-reports'
-            folder = 'raw/'
-            response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=folder)
-            csvs = [obj['Key'] for obj in response.get('Contents', []) if obj['Key'].endswith('.csv')]
-            xlsx = [obj['Key'] for obj in response.get('Contents', []) if obj['Key'].endswith('.xlsx')]
-            for csv_file in csvs:
-                s3_filename = csv_file.split('/')[-1]
-                s3_report_file_name, s3_report_id, report_date = format_report_file_name(s3_filename)
-                set_s3_reports_extracted.add(s3_report_id)
-            for xlsx_file in xlsx:
-                s3_filename = xlsx_file.split('/')[-1]
-                s3_report_file_name, s3_report_id, report_date = format_report_file_name(s3_filename)
-                set_s3_reports_extracted.add(s3_report_id)
 
-            # Chequeamos si la fecha del ultimo reporte automatico creado ya existe en la base de datos
-            if str(report_id) not in set_s3_reports_extracted:
+            # Chequeamos si el ultimo reporte automatico creado ya existe en S3 (por id o porque ya lo bajo el webhook)
+            if str(report_id) not in set_s3_reports_extracted and report_file_name not in set_s3_reports_extracted:
                 # Agregamos el report id al nombre del archivo
                 name_part, ext = report_file_name.rsplit('.', 1)
                 formatted_report_file_name = f"{name_part}_{last_report_date}_{report_id}.{ext}"
-                s3_key = f'{folder}{formatted_report_file_name}'
-                # Guardamos en S3
-                print(save_report_to_s3(report_file_name, access_token, s3_client, bucket_name, s3_key, file_format, report_id, last_report_date))
+                pending_reports.append({
+                    'report_file_name': report_file_name,
+                    's3_key': f'{folder}{formatted_report_file_name}',
+                    'file_format': file_format,
+                    'report_id': report_id,
+                    'report_date': last_report_date
+                })
             else:
                 print(f'Archivo {report_id} ya cargado a S3')
 
+    # Descargamos los pendientes en paralelo y guardamos en S3
+    with session:
+        descargados, errores = download_reports(pending_reports, session, rate_limiter, s3_client, bucket_name)
+
+    if descargados:
+        for pending_report in pending_reports:
+            if pending_report['report_id'] in descargados:
+                set_s3_reports_extracted.add(str(pending_report['report_id']))
+                set_s3_reports_extracted.add(pending_report['report_file_name'])
+        save_report_index(s3_client, bucket_name, set_s3_reports_extracted)
+
+    print(f"Reportes subidos a S3: {len(descargados)} de {len(pending_reports)}")
+    if errores:
+        raise Exception(f"No se pudieron descargar los reportes: {errores}")
+
+def notified_file_name(notification):
+    file_url = notification.get('file_url') or ''
+    return notification.get('file_name') or file_url.rsplit('/', 1)[-1]
+
+# Funcion para armar la clave de S3 del reporte informado por una notificacion del webhook. El webhook no informa el id
+# del reporte: lo tomamos de la lista de reportes de Mercado Pago igual que la conciliacion, asi los dos caminos guardan
+# el reporte con la misma clave y el mismo REPORT_ID en Redshift
+def notified_report(notification, folder, reportes_por_archivo):
+    report_file_name = notified_file_name(notification)
+    reporte = reportes_por_archivo.get(report_file_name)
+    if reporte is None:
+        raise Exception(f"El reporte notificado {report_file_name} no figura en la lista de reportes de Mercado Pago")
+
+    report_id = reporte.get("id")
+    file_format = (reporte.get("format") or notification.get('file_type') or report_file_name.rsplit('.', 1)[-1]).upper()
+    last_report_date = report_last_date(reporte.get("end_date"))
+
+    name_part, ext = report_file_name.rsplit('.', 1)
+    s3_key = f"{folder}{name_part}_{last_report_date}_{report_id}.{ext}"
+    return report_file_name, s3_key, file_format, report_id, last_report_date
+
+# Funcion para extraer solo los reportes informados por el webhook, sin descargar el resto ni listar el bucket.
+# Con el webhook en modo batching una misma ejecucion trae varios reportes y se descargan con una sola sesion
+def extract_notified_reports(notifications):
+    s3_client = boto3.client('s3')
+    bucket_name = 'mercadopago-reports'
+    folder = 'raw/'
+    set_s3_reports_extracted = load_report_index(s3_client, bucket_name, folder)
+
+    pending_notifications = []
+    for notification in notifications:
+        report_file_name = notified_file_name(notification)
+        if report_file_name in set_s3_reports_extracted:
+            print(f'Archivo {report_file_name} ya cargado a S3')
+            continue
+        pending_notifications.append(notification)
+
+    if not pending_notifications:
+        return
+
+    access_token = auth_mp()
+    rate_limiter = RateLimiter(MP_MAX_REQUESTS_PER_SECOND)
+    errores = 0
+    with build_mp_session(access_token, pool_size=1) as session:
+        # Una sola consulta de la lista por ejecucion para resolver el id y la fecha de todos los reportes notificados
+        reportes_por_archivo = {reporte.get("file_name"): reporte for reporte in get_reports(session, rate_limiter)}
+        for notification in pending_notifications:
+            try:
+                report_file_name, s3_key, file_format, report_id, last_report_date = notified_report(notification, folder, reportes_por_archivo)
+                save_report_to_s3(report_file_name, session, rate_limiter, s3_client, bucket_name, s3_key, file_format, report_id, last_report_date)
+            except Exception as e:
+                print(f"❌ Error al descargar {notified_file_name(notification)}: {e}")
+                errores += 1
+                continue
+            set_s3_reports_extracted.add(report_file_name)
+            set_s3_reports_extracted.add(str(report_id))
+
+    # El manifiesto se guarda igual con los reportes que si se descargaron
+    save_report_index(s3_client, bucket_name, set_s3_reports_extracted)
+    if errores:
+        raise Exception(f"Fallaron {errores} de {len(pending_notifications)} descargas de reportes notificados")
+
 def lambda_handler(event, context):
     try:
-        extract_mercado_pago_reports()
+        # Si el evento viene del webhook con los reportes generados, bajamos solo esos reportes.
+        # Las ejecuciones programadas (sin archivos en el evento) hacen la conciliacion completa
+        if isinstance(event, dict) and event.get('files'):
+            extract_notified_reports(event['files'])
+        elif isinstance(event, dict) and (event.get('file_name') or event.get('file_url')):
+            extract_notified_reports([event])
+        else:
+            extract_mercado_pago_reports()
     except Exception as e:
         print("⚠️ Error:", str(e))
         return {
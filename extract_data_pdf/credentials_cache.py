@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+import boto3
+
+# Cache de credenciales del contenedor de Lambda. Los parametros de Parameter Store y las credenciales OAuth de
+# Google quedan en memoria mientras el contenedor siga caliente, asi las invocaciones siguientes no vuelven a
+# llamar a SSM ni a Secrets Manager. El lock hace que los refrescos sean single-flight: si varios hilos piden la
+# misma credencial vencida, solo uno la refresca y el resto reutiliza el resultado.
+REGION_NAME = 'us-east-2'
+PARAMETER_TTL_SECONDS = 15 * 60
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+_lock = threading.RLock()
+_clients = {}
+_parameters = {}
+_google_credentials = {}
+
+def _get_client(service_name):
+    if service_name not in _clients:
+        _clients[service_name] = boto3.client(service_name, region_name=REGION_NAME)
+    return _clients[service_name]
+
+# Funcion para obtener un parametro (desencriptado) de Parameter Store, cacheado por ttl segundos
+def get_parameter(name, ttl=PARAMETER_TTL_SECONDS):
+    with _lock:
+        cached = _parameters.get(name)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        response = _get_client('ssm').get_parameter(Name=name, WithDecryption=True)
+        value = response['Parameter']['Value']
+        _parameters[name] = (value, time.monotonic() + ttl)
+        return value
+
+def get_secret(secret_name):
+    response = _get_client('secretsmanager').get_secret_value(SecretId=secret_name)
+    return json.loads(response['SecretString'])
+
+def update_secret(updated_token_json, secret_name):
+    _get_client('secretsmanager').update_secret(
+        SecretId=secret_name,
+        SecretString=updated_token_json
+    )
+
+# El token se refresca un poco antes de vencer para que no expire a mitad de una invocacion
+def _needs_refresh(creds):
+    if not creds.refresh_token:
+        return False
+    if not creds.token:
+        return True
+    return creds.expiry is not None and creds.expiry - TOKEN_REFRESH_MARGIN <= datetime.utcnow()
+
+# Funcion para obtener las credenciales OAuth de Google guardadas en Secrets Manager. El secreto solo se lee en el
+# primer uso del contenedor y solo se reescribe si Google devuelve un refresh token distinto al guardado
+def get_google_credentials(secret_name, scopes):
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+
+    cache_key = (secret_name, tuple(scopes))
+    with _lock:
+        cached = _google_credentials.get(cache_key)
+        if cached is None:
+            token_info = get_secret(secret_name)
+            creds = Credentials.from_authorized_user_info(token_info, scopes)
+            cached = {'creds': creds, 'refresh_token': creds.refresh_token}
+            _google_credentials[cache_key] = cached
+
+        creds = cached['creds']
+        if _needs_refresh(creds):
+            creds.refresh(Request())
+            print("♻️ Token refrescado")
+
+            # Guardar el token actualizado en Secrets Manager solo si cambio el refresh token
+            if creds.refresh_token != cached['refresh_token']:
+                update_secret(creds.to_json(), secret_name)
+                cached['refresh_token'] = creds.refresh_token
+
+        return creds
@@ -0,0 +1,77 @@
+# Transferencia en streaming de una respuesta HTTP a S3. Los chunks de la respuesta se acumulan hasta el
+# tamaño minimo de parte de S3 y se suben como multipart upload, asi la memoria usada por transferencia
+# queda acotada a una parte sin importar el tamaño del archivo. Si el archivo entra en una sola parte se
+# sube con un put_object comun.
+CHUNK_SIZE = 64 * 1024
+PART_SIZE = 5 * 1024 * 1024  # Minimo permitido por S3 para las partes de un multipart upload (salvo la ultima)
+
+def _validate_prefix(buffer, expected_prefix, key):
+    if bytes(buffer[:len(expected_prefix)]) != expected_prefix:
+        raise ValueError(f"Contenido inválido para {key}: no comienza con {expected_prefix!r}")
+
+# Funcion para volcar una respuesta de requests (abierta con stream=True) directamente en S3.
+# expected_prefix se valida con los primeros bytes recibidos y min_size antes de confirmar la subida.
+# Devuelve la cantidad de bytes subidos.
+def stream_response_to_s3(response, s3_client, bucket_name, key, content_type,
+                          expected_prefix=None, min_size=0, part_size=PART_SIZE):
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None and content_length.isdigit() and int(content_length) < min_size:
+        raise ValueError(f"Contenido inválido para {key}: {content_length} bytes, mínimo {min_size}")
+
+    buffer = bytearray()
+    total_bytes = 0
+    prefix_validado = expected_prefix is None
+    upload_id = None
+    parts = []
+
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if not chunk:
+                continue
+            buffer.extend(chunk)
+            total_bytes += len(chunk)
+
+            if not prefix_validado and len(buffer) >= len(expected_prefix):
+                _validate_prefix(buffer, expected_prefix, key)
+                prefix_validado = True
+
+            if len(buffer) >= part_size:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(
+                        Bucket=bucket_name, Key=key, ContentType=content_type
+                    )['UploadId']
+                part_number = len(parts) + 1
+                part = s3_client.upload_part(
+                    Bucket=bucket_name, Key=key, UploadId=upload_id,
+                    PartNumber=part_number, Body=bytes(buffer)
+                )
+                parts.append({'ETag': part['ETag'], 'PartNumber': part_number})
+                buffer.clear()
+
+        if not prefix_validado:
+            _validate_prefix(buffer, expected_prefix, key)
+        if total_bytes < min_size:
+            raise ValueError(f"Contenido inválido para {key}: {total_bytes} bytes, mínimo {min_size}")
+
+        if upload_id is None:
+            s3_client.put_object(Bucket=bucket_name, Key=key, Body=bytes(buffer), ContentType=content_type)
+            return total_bytes
+
+        if buffer:
+            part_number = len(parts) + 1
+            part = s3_client.upload_part(
+                Bucket=bucket_name, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=bytes(buffer)
+            )
+            parts.append({'ETag': part['ETag'], 'PartNumber': part_number})
+
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        return total_bytes
+    except Exception:
+        # Si algo falla a mitad de camino descartamos las partes subidas para no dejar uploads huerfanos
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
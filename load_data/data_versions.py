@@ -0,0 +1,30 @@
+import os
+import time
+import boto3
+
+# Versiones de datos por tabla de Redshift. load_data incrementa la version de una tabla despues de cada carga
+# confirmada y el agente de IA la usa como parte de la clave de su cache de resultados: mientras la version no
+# cambie, la misma consulta devuelve lo mismo. El incremento es atomico (ADD), asi cargas concurrentes no se pisan.
+DATA_VERSIONS_TABLE = os.environ.get('DATA_VERSIONS_TABLE')
+
+_table = None
+
+def _get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource('dynamodb').Table(DATA_VERSIONS_TABLE)
+    return _table
+
+# Funcion para incrementar la version de datos de una tabla, devuelve la nueva version (None si no hay tabla configurada)
+def bump_data_version(table_name):
+    if not DATA_VERSIONS_TABLE:
+        return None
+    response = _get_table().update_item(
+        Key={'table_name': table_name},
+        UpdateExpression='ADD version :one SET updated_at = :now',
+        ExpressionAttributeValues={':one': 1, ':now': int(time.time())},
+        ReturnValues='UPDATED_NEW'
+    )
+    version = int(response['Attributes']['version'])
+    print(f"🔢 Version de datos de {table_name} avanzada a {version}")
+    return version
@@ -1,7 +1,10 @@
 import pandas as pd
 import boto3
 import io
-import json
+from schema_migrations import ensure_schema, wait_for_statement
+from watermarks import advance_watermark
+from data_versions import bump_data_version
+from spend_summary import refresh_spend_summary, SUMMARY_TABLE, MONTHLY_VIEW
 
 def format_value(val):
     if val is None or pd.isna(val):
@@ -14,6 +17,7 @@ def format_value(val):
 
 # Funcion para cargar los datos de los archivos transformados de los PDFs en la tabla de Redshift
 def load_to_redshift_pdf_ticket(redshift_data, df, pdf_key):
+    statement_ids = []
     for _, row in df.iterrows():
         sql = f"""
         INSERT INTO carrefour_data VALUES (
@@ -29,11 +33,14 @@ def load_to_redshift_pdf_ticket(redshift_data, df, pdf_key):
             '{row['total_ticket_meli']}'
         )
         """
-        redshift_data.execute_statement(
+        response = redshift_data.execute_statement(
             Database='dev',
             WorkgroupName='pdf-etl-workgroup',
             Sql=sql
         )
+        statement_ids.append(response['Id'])
+
+    return statement_ids
 
 # Funcion para cargar los datos de los archivos transformados de los reportes de MP en la tabla de Redshift
 def load_to_redshift_mp_report(redshift_data, report_df, report_id, report_date):    
@@ -70,6 +77,7 @@ def load_to_redshift_mp_report(redshift_data, report_df, report_id, report_date)
             print("Error al consultar Redshift:", desc['Error'])
             break
            
+    statement_ids = []
     if report_id not in set_redshift_reports_loaded:
         inserted_rows = 0
         for _, row in report_df.iterrows():
@@ -109,11 +117,12 @@ def load_to_redshift_mp_report(redshift_data, report_df, report_id, report_date)
                         {format_value(row['SUB_UNIT'])}
                 )
                 """
-                redshift_data.execute_statement(
+                response = redshift_data.execute_statement(
                     Database='dev',
                     WorkgroupName='pdf-etl-workgroup',
                     Sql=sql
                 )
+                statement_ids.append(response['Id'])
                 inserted_rows += 1
             except:
                 sql = f"""
@@ -151,15 +160,18 @@ def load_to_redshift_mp_report(redshift_data, report_df, report_id, report_date)
                         {format_value(row['PLATAFORMA DE COBRO'])}
                     ) 
                 """
-                redshift_data.execute_statement(
+                response = redshift_data.execute_statement(
                     Database='dev',
                     WorkgroupName='pdf-etl-workgroup',
                     Sql=sql
                 )
+                statement_ids.append(response['Id'])
                 inserted_rows += 1
 
         print(f"✅ Insertadas {inserted_rows} filas del reporte {report_id} con fecha {report_date}")
 
+    return statement_ids
+
 # Funcion para cargar en la tabla de Redshift los datos del csv que representa el gasto extraido del mail con el gasto reportado del banco
 def load_to_redshift_bank_payment(redshift_data, df):
     id = df['id'].iloc[0]
@@ -197,6 +209,7 @@ def load_to_redshift_bank_payment(redshift_data, df):
             print("Error al consultar Redshift:", desc['Error'])
             break
     
+    statement_ids = []
     if id not in set_redshift_gastos_cargados:
         inserted_rows = 0
         for _, row in df.iterrows():
@@ -245,20 +258,60 @@ def load_to_redshift_bank_payment(redshift_data, df):
             )
             """
 
-            redshift_data.execute_statement(
+            response = redshift_data.execute_statement(
                 Database='dev',
                 WorkgroupName='pdf-etl-workgroup',
                 Sql=sql
             )
+            statement_ids.append(response['Id'])
             inserted_rows += 1
         
         print(f"✅ Insertadas {inserted_rows} filas del gasto de {divisa} {monto} en {comercio} con fecha {fecha_pago}")
 
+    return statement_ids
+
+# Funcion para registrar en la tabla de control que el archivo se empezo a cargar. Si la carga falla, el flujo de
+# compensacion encuentra la fila y la marca como FAILED
+def register_loading_file(redshift_data, file_id, etl_flow):
+    response = redshift_data.execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sql="INSERT INTO etl_file_control (file_id, etl_flow, status) VALUES (:file_id, :etl_flow, 'LOADING')",
+        Parameters=[
+            {'name': 'file_id', 'value': file_id},
+            {'name': 'etl_flow', 'value': etl_flow}
+        ]
+    )
+    return response['Id']
+
+# Funcion para marcar el archivo como LOADED una vez confirmadas todas sus sentencias de carga
+def mark_file_loaded(redshift_data, file_id, etl_flow):
+    response = redshift_data.execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sql="UPDATE etl_file_control SET status = 'LOADED', updated_at = GETDATE() WHERE file_id = :file_id AND etl_flow = :etl_flow AND status = 'LOADING'",
+        Parameters=[
+            {'name': 'file_id', 'value': file_id},
+            {'name': 'etl_flow', 'value': etl_flow}
+        ]
+    )
+    return response['Id']
+
+# Funcion para confirmar que terminaron todas las sentencias de carga antes de avanzar la marca de agua
+def confirm_statements(redshift_data, statement_ids):
+    for statement_id in statement_ids:
+        desc = wait_for_statement(redshift_data, statement_id)
+        if desc['Status'] != 'FINISHED':
+            raise Exception(f"Fallo la carga en Redshift ({statement_id}): {desc.get('Error')}")
+
 def lambda_handler(event,context):
     try:
         # Conexion a Redshift
         redshift_data = boto3.client('redshift-data')
 
+        # Validamos (una vez por contenedor) que las tablas destino existan y esten en la ultima version
+        ensure_schema(redshift_data)
+
         print(event['body'])
 
         # Obtenemos los datos de lo que necesitamos cargar, si es un pdf de tickets o un reporte de Mercado Pago
@@ -277,22 +330,55 @@ def lambda_handler(event,context):
         else:
             raise Exception("Formato no soportado")
 
+        # Antes de insertar dejamos registrado el archivo, asi una carga a medias queda visible para la compensacion
+        confirm_statements(redshift_data, [register_loading_file(redshift_data, key, etl_flow)])
+
         if etl_flow == 'MP':
             report_id = event['report_id']
             report_date = event['report_date']
             print('Se lee el csv o xlsx de reporte de mp convertido en S3 y se mergea a la tabla de mp_data')
-            load_to_redshift_mp_report(redshift_data, df, report_id, report_date)
+            statement_ids = load_to_redshift_mp_report(redshift_data, df, report_id, report_date)
+            dataset = 'mp_data'
+            fecha_maxima = pd.to_datetime(report_date, errors='coerce')
+            # Igual que en la carga, si el reporte viene con los encabezados en castellano la fecha esta en FECHA DE ORIGEN
+            columna_fecha = 'TRANSACTION_DATE' if 'TRANSACTION_DATE' in df.columns else 'FECHA DE ORIGEN'
+            fechas_texto = df[columna_fecha].astype(str)
+            fechas_gasto = pd.to_datetime(fechas_texto.str[:10], format='%Y-%m-%d', errors='coerce').fillna(
+                pd.to_datetime(fechas_texto.str[:10], format='%d/%m/%Y', errors='coerce')
+            )
         elif etl_flow == 'TICKET':
             report_id, report_date = '', ''
             print('Se lee el pdf convertido en csv en S3 y se mergea a la tabla de carrefour_data')
-            load_to_redshift_pdf_ticket(redshift_data, df, key)
+            statement_ids = load_to_redshift_pdf_ticket(redshift_data, df, key)
+            dataset = 'carrefour_data'
+            fechas_gasto = pd.to_datetime(df['fecha'], dayfirst=True, errors='coerce')
+            fecha_maxima = fechas_gasto.max()
         else: # es un gasto del banco
             print('Se lee el mail convertido en csv en S3 y se mergea a la tabla de bank_payments')
-            load_to_redshift_bank_payment(redshift_data, df) 
+            statement_ids = load_to_redshift_bank_payment(redshift_data, df) 
+            dataset = 'bank_payments'
+            fechas_gasto = pd.to_datetime(df['fecha_pago'], dayfirst=True, errors='coerce')
+            fecha_maxima = fechas_gasto.max()
+
+        # Confirmamos la carga y recien ahi marcamos el archivo como LOADED (tambien si no traia filas nuevas)
+        confirm_statements(redshift_data, statement_ids)
+        confirm_statements(redshift_data, [mark_file_loaded(redshift_data, key, etl_flow)])
+
+        # Si el archivo trajo filas nuevas actualizamos el resumen, el cache del agente y la marca de agua del dataset
+        if statement_ids:
+            # Recalculamos el resumen de gastos solo para los dias que trajo el archivo
+            if not pd.isna(fechas_gasto.min()):
+                confirm_statements(redshift_data, [
+                    refresh_spend_summary(redshift_data, dataset, fechas_gasto.min(), fechas_gasto.max())
+                ])
+
+            # Las tablas cambiaron: invalidamos los resultados cacheados por el agente de IA
+            for tabla in (dataset, SUMMARY_TABLE, MONTHLY_VIEW):
+                bump_data_version(tabla)
+            if not pd.isna(fecha_maxima):
+                advance_watermark(s3, bucket, dataset, fecha_maxima)
 
     except Exception as e:
+        # Propagamos el error para que el Catch de la Step Function dispare el flujo de compensacion
         print("⚠️ Error:", str(e))
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": str(e)})
-        }
\ No newline at end of file
+        raise
\ No newline at end of file
@@ -0,0 +1,147 @@
+import time
+from spend_summary import SUMMARY_TABLE, SUMMARY_DDL, MONTHLY_VIEW, MONTHLY_VIEW_DDL, build_summary_backfill
+
+DATABASE = 'dev'
+WORKGROUP_NAME = 'pdf-etl-workgroup'
+CONTROL_TABLE = 'schema_migrations'
+
+# Registro de migraciones de las tablas productivas de Redshift. Cada migracion es (version, tabla, ddl), donde ddl
+# es una sentencia o una lista de sentencias que se aplican en la misma transaccion. Las versiones son crecientes y nunca se modifican una vez aplicadas: los cambios de esquema se agregan
+# como una nueva entrada al final de la lista.
+MIGRATIONS = [
+    (1, 'bank_payments', """
+        CREATE TABLE IF NOT EXISTS bank_payments (
+            id           VARCHAR(32) PRIMARY KEY,
+            message_id   VARCHAR(255),
+            fecha_pago   DATE,
+            hora_pago    TIME,
+            monto        DECIMAL(12,2),
+            divisa       VARCHAR(5),
+            tarjeta      VARCHAR(50),
+            nro_tarjeta  VARCHAR(10),
+            comercio     VARCHAR(100),
+            cuotas       INT,
+            extraido_en  TIMESTAMP
+        )
+    """),
+    (2, 'carrefour_data', """
+        CREATE TABLE IF NOT EXISTS carrefour_data (
+            nro_ticket          VARCHAR(50),
+            fecha               VARCHAR(10),
+            categ               VARCHAR(100),
+            prod                VARCHAR(255),
+            cant                VARCHAR(20),
+            peso                VARCHAR(20),
+            p_unit              VARCHAR(20),
+            p_total             VARCHAR(20),
+            total_ticket_bruto  VARCHAR(20),
+            total_ticket_meli   VARCHAR(20)
+        )
+    """),
+    (3, 'mp_data', """
+        CREATE TABLE IF NOT EXISTS mp_data (
+            SOURCE_ID            VARCHAR(50),
+            REPORT_ID            VARCHAR(50),
+            REPORT_DATE          VARCHAR(10),
+            SETTLEMENT_DATE      VARCHAR(50),
+            PAYMENT_METHOD_TYPE  VARCHAR(50),
+            TRANSACTION_TYPE     VARCHAR(50),
+            TRANSACTION_AMOUNT   DECIMAL(12,2),
+            TRANSACTION_DATE     VARCHAR(50),
+            REAL_AMOUNT          DECIMAL(12,2),
+            POS_ID               VARCHAR(50),
+            STORE_ID             VARCHAR(50),
+            STORE_NAME           VARCHAR(255),
+            PAYER_NAME           VARCHAR(255),
+            BUSINESS_UNIT        VARCHAR(100),
+            SUB_UNIT             VARCHAR(100)
+        )
+    """),
+    (4, 'etl_file_control', """
+        CREATE TABLE IF NOT EXISTS etl_file_control (
+            file_id     VARCHAR(512),
+            etl_flow    VARCHAR(20),
+            status      VARCHAR(20),
+            updated_at  TIMESTAMP DEFAULT GETDATE()
+        )
+    """),
+    (5, SUMMARY_TABLE, SUMMARY_DDL),
+    (6, MONTHLY_VIEW, MONTHLY_VIEW_DDL),
+    # Carga inicial del resumen con la historia de cada fuente, despues se mantiene en cada carga de load_data
+    (7, SUMMARY_TABLE, build_summary_backfill('bank_payments')),
+    (8, SUMMARY_TABLE, build_summary_backfill('mp_data')),
+    (9, SUMMARY_TABLE, build_summary_backfill('carrefour_data')),
+]
+
+# Cache del contenedor de Lambda: una vez validado el esquema no se vuelve a consultar mientras el contenedor siga caliente
+_schema_al_dia = False
+
+# Funcion para esperar a que termine una sentencia de la Data API de Redshift
+def wait_for_statement(redshift_data, statement_id):
+    while True:
+        desc = redshift_data.describe_statement(Id=statement_id)
+        if desc['Status'] in ('FINISHED', 'FAILED', 'ABORTED'):
+            return desc
+        time.sleep(0.5)
+
+# Funcion para obtener las versiones de esquema ya aplicadas. Solo si la tabla de control no existe se asume un esquema
+# vacio, cualquier otro error se propaga para no reaplicar migraciones sobre tablas que ya tienen datos
+def get_applied_versions(redshift_data):
+    response = redshift_data.execute_statement(
+        Database=DATABASE,
+        WorkgroupName=WORKGROUP_NAME,
+        Sql=f"SELECT version FROM {CONTROL_TABLE}"
+    )
+    desc = wait_for_statement(redshift_data, response['Id'])
+    if desc['Status'] != 'FINISHED':
+        error = desc.get('Error', '')
+        if 'does not exist' in error:
+            print(f"ℹ️ No existe {CONTROL_TABLE}, se aplican todas las migraciones")
+            return set()
+        raise Exception(f"Error al leer {CONTROL_TABLE}: {error}")
+
+    result = redshift_data.get_statement_result(Id=response['Id'])
+    return {row[0]['longValue'] for row in result['Records']}
+
+# Funcion para aplicar las migraciones pendientes en una sola transaccion de la Data API
+def apply_migrations(redshift_data, pending):
+    sqls = [f"""
+        CREATE TABLE IF NOT EXISTS {CONTROL_TABLE} (
+            version     INT PRIMARY KEY,
+            table_name  VARCHAR(100),
+            applied_at  TIMESTAMP DEFAULT GETDATE()
+        )
+    """]
+    for version, table_name, ddl in pending:
+        if isinstance(ddl, list):
+            sqls.extend(ddl)
+        else:
+            sqls.append(ddl)
+        sqls.append(f"INSERT INTO {CONTROL_TABLE} (version, table_name) VALUES ({version}, '{table_name}')")
+
+    response = redshift_data.batch_execute_statement(
+        Database=DATABASE,
+        WorkgroupName=WORKGROUP_NAME,
+        Sqls=sqls
+    )
+    desc = wait_for_statement(redshift_data, response['Id'])
+    if desc['Status'] != 'FINISHED':
+        raise Exception(f"Error al aplicar migraciones de esquema: {desc.get('Error')}")
+
+    for version, table_name, _ in pending:
+        print(f"✅ Migracion {version} aplicada sobre {table_name}")
+
+# Funcion que garantiza que las tablas productivas esten al dia. En un contenedor caliente no hace ninguna consulta
+def ensure_schema(redshift_data):
+    global _schema_al_dia
+    if _schema_al_dia:
+        return
+
+    applied = get_applied_versions(redshift_data)
+    pending = [migration for migration in MIGRATIONS if migration[0] not in applied]
+    if pending:
+        apply_migrations(redshift_data, pending)
+    else:
+        print("✅ Esquema de Redshift al dia")
+
+    _schema_al_dia = True
@@ -0,0 +1,118 @@
+# Capa de resumen de gastos para las consultas del agente de IA. spend_daily_summary guarda el gasto por dia, fuente,
+# categoria, comercio y divisa, y spend_monthly_summary (una vista sobre la diaria) lo agrupa por mes. Despues de
+# cada carga confirmada load_data recalcula solo los dias que tocó el archivo, reemplazando esas filas del resumen
+# en una sola transaccion, asi las fechas en texto se parsean una vez al cargar y no en cada consulta.
+SUMMARY_TABLE = 'spend_daily_summary'
+MONTHLY_VIEW = 'spend_monthly_summary'
+
+SUMMARY_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+        fecha           DATE,
+        fuente          VARCHAR(20),
+        categoria       VARCHAR(100),
+        comercio        VARCHAR(255),
+        divisa          VARCHAR(5),
+        monto_total     DECIMAL(14,2),
+        cantidad        INT,
+        monto_maximo    DECIMAL(12,2),
+        actualizado_en  TIMESTAMP DEFAULT GETDATE()
+    )
+"""
+
+MONTHLY_VIEW_DDL = f"""
+    CREATE OR REPLACE VIEW {MONTHLY_VIEW} AS
+    SELECT
+        DATE_TRUNC('month', fecha)::DATE AS mes,
+        fuente,
+        categoria,
+        comercio,
+        divisa,
+        SUM(monto_total)  AS monto_total,
+        SUM(cantidad)     AS cantidad,
+        MAX(monto_maximo) AS monto_maximo
+    FROM {SUMMARY_TABLE}
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+# Por dataset: fuente del resumen, fecha del gasto y columnas de la tabla origen. Las columnas de texto se validan
+# con una expresion regular antes de convertirlas para que una fila mal formada no haga fallar el recalculo
+SUMMARY_SOURCES = {
+    'bank_payments': {
+        'fuente': 'banco',
+        'fecha': "fecha_pago",
+        # El mail del banco no trae rubro del gasto: la tarjeta no es una categoria y se deja nula
+        'categoria': "CAST(NULL AS VARCHAR(100))",
+        'comercio': "comercio",
+        'divisa': "divisa",
+        'monto': "monto",
+        'tabla': 'bank_payments',
+    },
+    'mp_data': {
+        'fuente': 'mercado_pago',
+        'fecha': "CASE WHEN transaction_date ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN TO_DATE(LEFT(transaction_date, 10), 'YYYY-MM-DD') "
+                 "WHEN transaction_date ~ '^[0-9]{2}/[0-9]{2}/[0-9]{4}' THEN TO_DATE(LEFT(transaction_date, 10), 'DD/MM/YYYY') END",
+        'categoria': "transaction_type",
+        'comercio': "store_name",
+        'divisa': "'ARS'",
+        'monto': "transaction_amount",
+        'tabla': 'mp_data',
+    },
+    'carrefour_data': {
+        'fuente': 'carrefour',
+        # Los tickets traen la fecha con año de cuatro o de dos digitos segun la version del pdf
+        'fecha': "CASE WHEN fecha ~ '^[0-9]{2}/[0-9]{2}/[0-9]{4}$' THEN TO_DATE(fecha, 'DD/MM/YYYY') "
+                 "WHEN fecha ~ '^[0-9]{2}/[0-9]{2}/[0-9]{2}$' THEN TO_DATE(fecha, 'DD/MM/YY') END",
+        'categoria': "categ",
+        'comercio': "'Carrefour'",
+        'divisa': "'ARS'",
+        'monto': "CASE WHEN p_total ~ '^-?[0-9]+(\\\\.[0-9]+)?$' THEN CAST(p_total AS DECIMAL(12,2)) END",
+        'tabla': 'carrefour_data',
+    },
+}
+
+# Funcion para armar el INSERT ... SELECT que agrega una fuente en el resumen diario, opcionalmente para un rango de fechas
+def build_summary_insert(dataset, fecha_desde=None, fecha_hasta=None):
+    source = SUMMARY_SOURCES[dataset]
+    where = f"WHERE {source['fecha']} IS NOT NULL"
+    if fecha_desde is not None and fecha_hasta is not None:
+        where += f" AND {source['fecha']} BETWEEN '{fecha_desde}' AND '{fecha_hasta}'"
+    return f"""
+        INSERT INTO {SUMMARY_TABLE} (fecha, fuente, categoria, comercio, divisa, monto_total, cantidad, monto_maximo)
+        SELECT
+            {source['fecha']} AS fecha,
+            '{source['fuente']}' AS fuente,
+            {source['categoria']} AS categoria,
+            {source['comercio']} AS comercio,
+            {source['divisa']} AS divisa,
+            SUM({source['monto']}) AS monto_total,
+            COUNT(*) AS cantidad,
+            MAX({source['monto']}) AS monto_maximo
+        FROM {source['tabla']}
+        {where}
+        GROUP BY 1, 2, 3, 4, 5
+    """
+
+# Funcion para armar la carga inicial de una fuente: borra lo que haya de esa fuente y la vuelve a agregar completa,
+# asi reaplicar la migracion (por ejemplo si dos contenedores la corren a la vez) no duplica filas
+def build_summary_backfill(dataset):
+    fuente = SUMMARY_SOURCES[dataset]['fuente']
+    return [
+        f"DELETE FROM {SUMMARY_TABLE} WHERE fuente = '{fuente}'",
+        build_summary_insert(dataset)
+    ]
+
+# Funcion para recalcular el resumen de los dias que tocó una carga, devuelve el id de la sentencia para confirmarla
+def refresh_spend_summary(redshift_data, dataset, fecha_desde, fecha_hasta):
+    fecha_desde = fecha_desde.strftime('%Y-%m-%d')
+    fecha_hasta = fecha_hasta.strftime('%Y-%m-%d')
+    fuente = SUMMARY_SOURCES[dataset]['fuente']
+    response = redshift_data.batch_execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sqls=[
+            f"DELETE FROM {SUMMARY_TABLE} WHERE fuente = '{fuente}' AND fecha BETWEEN '{fecha_desde}' AND '{fecha_hasta}'",
+            build_summary_insert(dataset, fecha_desde, fecha_hasta)
+        ]
+    )
+    print(f"📊 Resumen de gastos de {fuente} recalculado entre {fecha_desde} y {fecha_hasta}")
+    return response['Id']
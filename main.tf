@@ -46,6 +46,12 @@ variable "OPENAI_API_KEY" {
   sensitive   = true
 }
 
+variable "CIFRADO_SECRET_MP" {
+  description = "Secreto de Mercado Pago para validar la firma de los webhooks de reportes"
+  type        = string
+  sensitive   = true
+}
+
 ########### 1. Buckets de S3 ###########
 # 1.1 Bucket para PDF de Gmail
 resource "aws_s3_bucket" "market_tickets" {
@@ -65,11 +71,76 @@ resource "aws_s3_bucket" "bank_payments" {
   force_destroy = true
 }
 
+# 1.4 Bucket de staging para los archivos Parquet del UNLOAD de Redshift hacia BigQuery
+resource "aws_s3_bucket" "redshift_unload_staging" {
+  bucket        = "redshift-unload-staging"
+  force_destroy = true
+}
+
+# Los archivos se borran al terminar la carga, la expiracion cubre las corridas que fallen a mitad de camino
+resource "aws_s3_bucket_lifecycle_configuration" "redshift_unload_staging" {
+  bucket = aws_s3_bucket.redshift_unload_staging.id
+
+  rule {
+    id     = "expire-unload-staging"
+    status = "Enabled"
+
+    filter {
+      prefix = "unload/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
+}
+
 ########### 2. Redshift Serverless ###########
 # Creamos el namespace
 resource "aws_redshiftserverless_namespace" "etl_namespace" {
-  namespace_name = "pdf-etl-namespace"
-  db_name        = "dev"
+  namespace_name       = "pdf-etl-namespace"
+  db_name              = "dev"
+  iam_roles            = [aws_iam_role.redshift_unload_role.arn]
+  default_iam_role_arn = aws_iam_role.redshift_unload_role.arn
+}
+
+# Rol que asume Redshift para escribir los archivos del UNLOAD en el bucket de staging
+resource "aws_iam_role" "redshift_unload_role" {
+  name = "redshift_unload_role"
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Principal = {
+          Service = ["redshift.amazonaws.com", "redshift-serverless.amazonaws.com"]
+        },
+        Action = "sts:AssumeRole"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "redshift_unload_s3" {
+  name = "redshift_unload_s3"
+  role = aws_iam_role.redshift_unload_role.id
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action = [
+          "s3:PutObject",
+          "s3:GetBucketLocation",
+          "s3:ListBucket"
+        ],
+        Effect = "Allow",
+        Resource = [
+          aws_s3_bucket.redshift_unload_staging.arn,
+          "${aws_s3_bucket.redshift_unload_staging.arn}/*"
+        ]
+      }
+    ]
+  })
 }
 
 # Creamos el workgroup
@@ -81,6 +152,84 @@ resource "aws_redshiftserverless_workgroup" "etl_workgroup" {
   publicly_accessible = true
 }
 
+########### 2.1 DynamoDB ###########
+# Registro de entregas del webhook de Mercado Pago ya procesadas, para no disparar ejecuciones duplicadas por reintentos
+resource "aws_dynamodb_table" "mp_webhook_deliveries" {
+  name         = "mp-webhook-deliveries"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "idempotency_key"
+
+  attribute {
+    name = "idempotency_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# Registro de fallas de los flujos ETL, particionado por flujo y dia con sort key ordenada por tiempo
+resource "aws_dynamodb_table" "etl_failures" {
+  name         = "etl-failures"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+  range_key    = "sk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  attribute {
+    name = "sk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# Cache pregunta -> SQL del agente de IA, las entradas vencen por TTL
+resource "aws_dynamodb_table" "ai_agent_sql_cache" {
+  name         = "ai-agent-sql-cache"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "cache_key"
+
+  attribute {
+    name = "cache_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# Version de datos por tabla de Redshift, la incrementa load_data y la usa el agente de IA para su cache de resultados
+resource "aws_dynamodb_table" "etl_data_versions" {
+  name         = "etl-data-versions"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "table_name"
+
+  attribute {
+    name = "table_name"
+    type = "S"
+  }
+}
+
+########### 2.2 SQS ###########
+# Cola donde el webhook de Mercado Pago encola las notificaciones para agruparlas en una sola ejecucion del ETL
+resource "aws_sqs_queue" "mp_webhook_notifications" {
+  name                       = "mp-webhook-notifications"
+  visibility_timeout_seconds = 180  # Mayor que el timeout de la Lambda mas la ventana de batching
+  message_retention_seconds  = 345600
+}
+
 ########### 3. Repositorio ECR para las imágenes Lambda ###########
 resource "aws_ecr_repository" "lambda_images" {
   name                 = "etl-expenses"
@@ -217,6 +366,9 @@ resource "aws_lambda_function" "mp_report_extractor" {
     variables = {
       WORKGROUP_NAME = aws_redshiftserverless_workgroup.etl_workgroup.workgroup_name
       BUCKET_NAME    = aws_s3_bucket.mp_reports.bucket
+      # Presupuesto de llamados a la API de Mercado Pago y descargas en paralelo
+      MP_MAX_REQUESTS_PER_SECOND = "5"
+      MP_DOWNLOAD_WORKERS        = "4"
     }
   }
 }
@@ -287,8 +439,9 @@ resource "aws_lambda_function" "load_report_and_pdf" {
 
   environment {
     variables = {
-      WORKGROUP_NAME = aws_redshiftserverless_workgroup.etl_workgroup.workgroup_name
-      BUCKET_NAME    = aws_s3_bucket.mp_reports.bucket
+      WORKGROUP_NAME      = aws_redshiftserverless_workgroup.etl_workgroup.workgroup_name
+      BUCKET_NAME         = aws_s3_bucket.mp_reports.bucket
+      DATA_VERSIONS_TABLE = aws_dynamodb_table.etl_data_versions.name
     }
   }
 }
@@ -305,11 +458,23 @@ resource "aws_lambda_function" "webhook_mp_report" {
 
   environment {
     variables = {
-      STEP_FUNCTION_ARN = aws_sfn_state_machine.mp_report_etl_flow.arn
+      STEP_FUNCTION_ARN      = aws_sfn_state_machine.mp_report_etl_flow.arn
+      IDEMPOTENCY_TABLE      = aws_dynamodb_table.mp_webhook_deliveries.name
+      NOTIFICATION_BATCHING  = "true"
+      NOTIFICATION_QUEUE_URL = aws_sqs_queue.mp_webhook_notifications.url
+      CIFRADO_SECRET_MP      = var.CIFRADO_SECRET_MP
     }
   }
 }
 
+# Lotes de notificaciones del webhook: una ejecucion del ETL cada 10 notificaciones o cada 60 segundos
+resource "aws_lambda_event_source_mapping" "webhook_mp_report_batches" {
+  event_source_arn                   = aws_sqs_queue.mp_webhook_notifications.arn
+  function_name                      = aws_lambda_function.webhook_mp_report.arn
+  batch_size                         = 10
+  maximum_batching_window_in_seconds = 60
+}
+
 # 4.9 Lambda Compensation flow que limpia archivos temporales y el envia marca de que el proceso fallo por mail
 resource "aws_lambda_function" "compensation_flow" {
   function_name = "compensation_flow"
@@ -319,6 +484,13 @@ resource "aws_lambda_function" "compensation_flow" {
   
   memory_size = 1024  # Ajustar según necesidades
   timeout     = 900   # Máximo 15 minutos
+
+  environment {
+    variables = {
+      AWS_ACCOUNT_ID       = var.aws_account_id
+      FAILURE_LEDGER_TABLE = aws_dynamodb_table.etl_failures.name
+    }
+  }
 }
 
 # 4.10 Lambda data load de redshift a big query para visualizar los datos
@@ -330,6 +502,17 @@ resource "aws_lambda_function" "redshift_to_bq" {
   
   memory_size = 1024  # Ajustar según necesidades
   timeout     = 900   # Máximo 15 minutos
+
+  ephemeral_storage {
+    size = 1024  # Los archivos Parquet del modo UNLOAD pasan por /tmp
+  }
+
+  environment {
+    variables = {
+      UNLOAD_BUCKET   = aws_s3_bucket.redshift_unload_staging.bucket
+      UNLOAD_IAM_ROLE = aws_iam_role.redshift_unload_role.arn
+    }
+  }
 }
 
 # 4.11 Lambda para procesar el agente de IA y resolver las consultas sobre los datos en Redshift
@@ -344,10 +527,12 @@ resource "aws_lambda_function" "ai_agent" {
 
   environment {
     variables = {
-      REDSHIFT_WORKGROUP = aws_redshiftserverless_workgroup.etl_workgroup.workgroup_name
-      REDSHIFT_DATABASE  = "dev",
-      TELEGRAM_BOT_TOKEN = var.TELEGRAM_BOT_TOKEN,
-      OPENAI_API_KEY     = var.OPENAI_API_KEY
+      REDSHIFT_WORKGROUP  = aws_redshiftserverless_workgroup.etl_workgroup.workgroup_name
+      REDSHIFT_DATABASE   = "dev",
+      TELEGRAM_BOT_TOKEN  = var.TELEGRAM_BOT_TOKEN,
+      OPENAI_API_KEY      = var.OPENAI_API_KEY,
+      SQL_CACHE_TABLE     = aws_dynamodb_table.ai_agent_sql_cache.name,
+      DATA_VERSIONS_TABLE = aws_dynamodb_table.etl_data_versions.name
     }
   }
 }
@@ -497,7 +682,8 @@ resource "aws_iam_policy" "lambda_s3_access" {
           "s3:PutObject",
           "s3:GetObject",
           "s3:ListBucket",
-          "s3:DeleteObject"
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ],
         Effect = "Allow",
         Resource = [
@@ -506,7 +692,57 @@ resource "aws_iam_policy" "lambda_s3_access" {
           aws_s3_bucket.mp_reports.arn,
           "${aws_s3_bucket.mp_reports.arn}/*",
           "${aws_s3_bucket.bank_payments.arn}/*",
-          aws_s3_bucket.bank_payments.arn
+          aws_s3_bucket.bank_payments.arn,
+          aws_s3_bucket.redshift_unload_staging.arn,
+          "${aws_s3_bucket.redshift_unload_staging.arn}/*"
+        ]
+      }
+    ]
+  })
+}
+
+resource "aws_iam_policy" "lambda_dynamodb_access" {
+  name = "lambda_dynamodb_access"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem",
+          "dynamodb:DeleteItem",
+          "dynamodb:BatchWriteItem",
+          "dynamodb:Query",
+          "dynamodb:UpdateItem",
+          "dynamodb:BatchGetItem"
+        ],
+        Effect   = "Allow",
+        Resource = [
+          aws_dynamodb_table.mp_webhook_deliveries.arn,
+          aws_dynamodb_table.etl_failures.arn,
+          aws_dynamodb_table.ai_agent_sql_cache.arn,
+          aws_dynamodb_table.etl_data_versions.arn
+        ]
+      }
+    ]
+  })
+}
+
+resource "aws_iam_policy" "lambda_sqs_access" {
+  name = "lambda_sqs_access"
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ],
+        Effect   = "Allow",
+        Resource = [
+          aws_sqs_queue.mp_webhook_notifications.arn
         ]
       }
     ]
@@ -514,6 +750,16 @@ resource "aws_iam_policy" "lambda_s3_access" {
 }
 
 # Attachments de las políticas al rol
+resource "aws_iam_role_policy_attachment" "lambda_sqs" {
+  role       = aws_iam_role.lambda_exec.name
+  policy_arn = aws_iam_policy.lambda_sqs_access.arn
+}
+
+resource "aws_iam_role_policy_attachment" "lambda_dynamodb" {
+  role       = aws_iam_role.lambda_exec.name
+  policy_arn = aws_iam_policy.lambda_dynamodb_access.arn
+}
+
 resource "aws_iam_role_policy_attachment" "lambda_redshift" {
   role       = aws_iam_role.lambda_exec.name
   policy_arn = aws_iam_policy.lambda_redshift_access.arn
@@ -845,6 +1091,53 @@ resource "aws_cloudwatch_log_group" "etl_logs" {
   retention_in_days = 14
 }
 
+# 7.5 Fin de los crawlers de Glue: avisa al agente de IA para que invalide el esquema cacheado
+resource "aws_cloudwatch_event_rule" "glue_crawler_succeeded" {
+  name        = "glue_crawler_succeeded"
+  description = "Se dispara cuando termina con exito alguno de los crawlers del ETL"
+  event_pattern = jsonencode({
+    source        = ["aws.glue"],
+    "detail-type" = ["Glue Crawler State Change"],
+    detail = {
+      state       = ["Succeeded"],
+      crawlerName = [
+        aws_glue_crawler.market_tickets_crawler.name,
+        aws_glue_crawler.mp_reports_crawler.name,
+        aws_glue_crawler.bank_payments_crawler.name
+      ]
+    }
+  })
+}
+
+resource "aws_cloudwatch_event_target" "invalidate_ai_agent_schema" {
+  rule      = aws_cloudwatch_event_rule.glue_crawler_succeeded.name
+  target_id = "InvalidateAIAgentSchema"
+  arn       = aws_lambda_function.ai_agent.arn
+}
+
+resource "aws_lambda_permission" "allow_glue_crawler_events" {
+  statement_id  = "AllowGlueCrawlerEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.ai_agent.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.glue_crawler_succeeded.arn
+}
+
+# 7.6 Cron schedule para la conciliacion completa de reportes de Mercado Pago. El webhook solo baja los reportes
+# notificados: esta ejecucion (sin archivos en el evento) recupera los que se hayan perdido
+resource "aws_cloudwatch_event_rule" "daily_mp_reports_sweep" {
+  name                = "mp_reports_sweep_schedule"
+  description         = "Ejecuta la conciliacion de reportes de Mercado Pago todos los dias a las 6:00 AM UTC"
+  schedule_expression = "cron(0 6 * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "trigger_mp_reports_sweep" {
+  rule      = aws_cloudwatch_event_rule.daily_mp_reports_sweep.name
+  target_id = "TriggerMPReportsSweep"
+  arn       = aws_sfn_state_machine.mp_report_etl_flow.arn
+  role_arn  = aws_iam_role.step_function_role.arn
+}
+
 ########### 8. Step Function para orquestar Lambdas ###########
 
 # 8.1 Creacion del job de PDFs en Step Function
@@ -914,6 +1207,10 @@ resource "aws_sfn_state_machine" "pdf_etl_flow" {
       CompensationFlow: {
         "Type": "Task",
         "Resource": "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:compensation_flow",
+        "Parameters": {
+          "flow.$": "$$.StateMachine.Name",
+          "payload.$": "$"
+        },
         "End": true
       }
     }
@@ -939,11 +1236,6 @@ resource "aws_sfn_state_machine" "mp_report_etl_flow" {
       "Extract MP Reports" = {
         Type     = "Task",
         Resource = aws_lambda_function.mp_report_extractor.arn,
-        Parameters: {
-          "file_name.$": "$.file_name",
-          "file_url.$": "$.file_url",
-          "file_type.$": "$.file_type"
-        },
         Catch: [
           {
             "ErrorEquals": ["States.ALL"],
@@ -992,6 +1284,10 @@ resource "aws_sfn_state_machine" "mp_report_etl_flow" {
       CompensationFlow: {
         "Type": "Task",
         "Resource": "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:compensation_flow",
+        "Parameters": {
+          "flow.$": "$$.StateMachine.Name",
+          "payload.$": "$"
+        },
         "End": true
       }
     }
@@ -1065,6 +1361,10 @@ resource "aws_sfn_state_machine" "bank_payments_etl_flow" {
       CompensationFlow: {
         "Type": "Task",
         "Resource": "arn:aws:lambda:${var.aws_region}:${var.aws_account_id}:function:compensation_flow",
+        "Parameters": {
+          "flow.$": "$$.StateMachine.Name",
+          "payload.$": "$"
+        },
         "End": true
       }
     }
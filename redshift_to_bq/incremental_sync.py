@@ -0,0 +1,156 @@
+import json
+import uuid
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+# Sincronizacion incremental Redshift -> BigQuery. Por tabla se guarda una marca de agua (la ultima fila exportada
+# segun las columnas de orden) y cada corrida exporta solo las filas posteriores a una tabla de staging de BigQuery,
+# que despues se mergea en la tabla final reemplazando las filas con la misma clave. Las marcas de agua se guardan
+# junto a las de ingesta, en el bucket de cada dataset bajo state/bq_sync/.
+SYNC_PREFIX = 'state/bq_sync/'
+
+# Fecha de los tickets de Carrefour, guardada como texto DD/MM/YYYY o DD/MM/YY segun la version del pdf. Las fechas
+# vacias o mal formadas quedan nulas y no entran en la sincronizacion incremental
+CARREFOUR_FECHA = (
+    "CASE WHEN fecha ~ '^[0-9]{2}/[0-9]{2}/[0-9]{4}$' THEN TO_DATE(fecha, 'DD/MM/YYYY') "
+    "WHEN fecha ~ '^[0-9]{2}/[0-9]{2}/[0-9]{2}$' THEN TO_DATE(fecha, 'DD/MM/YY') END"
+)
+
+# Configuracion por tabla: bucket donde vive su estado, columnas (expresiones SQL) que ordenan la marca de agua
+# y columnas clave para el merge en BigQuery. carrefour_data no tiene clave por fila: la clave es el ticket, y como un
+# ticket se carga entero desde un solo pdf (misma fecha y nro_ticket) el merge reemplaza el ticket completo
+SYNC_TABLES = {
+    'bank_payments': {
+        'bucket': 'bank-payments',
+        'order_by': ['extraido_en'],
+        'keys': ['id']
+    },
+    'mp_data': {
+        'bucket': 'mercadopago-reports',
+        'order_by': ['report_date', 'report_id'],
+        'keys': ['report_id', 'source_id']
+    },
+    'carrefour_data': {
+        'bucket': 'market-tickets',
+        'order_by': [CARREFOUR_FECHA, 'nro_ticket'],
+        'keys': ['nro_ticket']
+    },
+}
+
+def sync_state_key(tabla):
+    return f"{SYNC_PREFIX}{tabla}.json"
+
+# Funcion para leer la marca de agua de sincronizacion de una tabla, devuelve None si nunca se sincronizo
+def read_sync_watermark(s3_client, tabla):
+    try:
+        response = s3_client.get_object(Bucket=SYNC_TABLES[tabla]['bucket'], Key=sync_state_key(tabla))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read())['watermark']
+
+def save_sync_watermark(s3_client, tabla, watermark):
+    state = {
+        'tabla': tabla,
+        'watermark': watermark,
+        'updated_at': datetime.utcnow().isoformat()
+    }
+    s3_client.put_object(
+        Bucket=SYNC_TABLES[tabla]['bucket'],
+        Key=sync_state_key(tabla),
+        Body=json.dumps(state),
+        ContentType='application/json'
+    )
+    print(f"📌 Marca de agua de sincronizacion de {tabla} avanzada a {watermark}")
+
+def sql_literal(value):
+    if value is None:
+        raise ValueError("La marca de agua de sincronizacion no puede tener valores nulos")
+    return "'" + str(value).replace("'", "''") + "'"
+
+# Funcion que arma la comparacion lexicografica (c1, c2, ...) <op> (v1, v2, ...) que Redshift no soporta con tuplas
+def tuple_comparison(columns, values, op):
+    column, value = columns[0], sql_literal(values[0])
+    if len(columns) == 1:
+        return f"{column} {op} {value}"
+    strict = '>' if op.startswith('>') else '<'
+    return f"({column} {strict} {value} OR ({column} = {value} AND {tuple_comparison(columns[1:], values[1:], op)}))"
+
+# Funcion que descarta las filas con alguna columna de orden nula, que no se pueden ubicar respecto de la marca de agua
+def not_null_filter(columns):
+    return ' AND '.join(f"({column}) IS NOT NULL" for column in columns)
+
+# Funcion para armar el filtro del delta: posterior a la marca de agua anterior y hasta el limite de esta corrida
+def build_delta_filter(tabla, watermark, upper_bound):
+    order_by = SYNC_TABLES[tabla]['order_by']
+    conditions = [not_null_filter(order_by), tuple_comparison(order_by, upper_bound, '<=')]
+    if watermark is not None:
+        conditions.insert(1, tuple_comparison(order_by, watermark, '>'))
+    return ' AND '.join(conditions)
+
+# Funcion para obtener el limite superior del delta (la ultima fila segun las columnas de orden), None si no hay filas nuevas.
+# Fijar el limite antes de exportar evita perder filas que se inserten en Redshift mientras corre la exportacion. Las filas
+# con columnas de orden nulas se excluyen porque en un ORDER BY DESC Redshift las ordena primero
+def fetch_delta_upper_bound(redshift_data, wait_for_statement, tabla, watermark):
+    order_by = SYNC_TABLES[tabla]['order_by']
+    where = f"WHERE {not_null_filter(order_by)}"
+    if watermark is not None:
+        where += f" AND {tuple_comparison(order_by, watermark, '>')}"
+    sql = f"SELECT {', '.join(order_by)} FROM {tabla} {where} ORDER BY {', '.join(c + ' DESC' for c in order_by)} LIMIT 1"
+    response = redshift_data.execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sql=sql
+    )
+    status = wait_for_statement(redshift_data, response['Id'])
+    if status['Status'] != 'FINISHED':
+        raise Exception(f"No se pudo calcular el delta de {tabla}: {status.get('Error')}")
+
+    records = redshift_data.get_statement_result(Id=response['Id'])['Records']
+    if not records:
+        return None
+    return [str(next(iter(cell.values()))) for cell in records[0]]
+
+def staging_table_id(table_id):
+    return f"{table_id}__staging_{uuid.uuid4().hex[:8]}"
+
+# Funcion para mergear la tabla de staging en la tabla final: se borran las filas con la misma clave y se insertan las
+# nuevas en una sola transaccion de BigQuery. Si la tabla final no existe se crea con el esquema del staging. Las claves
+# se comparan con IS NOT DISTINCT FROM porque pueden venir nulas (por ejemplo SOURCE_ID en mp_data) y con = esas filas
+# nunca coincidirian y se duplicarian en cada resincronizacion
+def merge_staging_table(client, staging_id, table_id, keys):
+    key_match = ' AND '.join(f"target.{key} IS NOT DISTINCT FROM staging.{key}" for key in keys)
+    script = f"""
+        CREATE TABLE IF NOT EXISTS `{table_id}` LIKE `{staging_id}`;
+        BEGIN TRANSACTION;
+        DELETE FROM `{table_id}` AS target
+        WHERE EXISTS (SELECT 1 FROM `{staging_id}` AS staging WHERE {key_match});
+        INSERT INTO `{table_id}` SELECT * FROM `{staging_id}`;
+        COMMIT TRANSACTION;
+    """
+    client.query(script).result()
+
+def drop_staging_table(client, staging_id):
+    client.delete_table(staging_id, not_found_ok=True)
+
+# Funcion que sincroniza el delta de una tabla: calcula el limite, exporta las filas nuevas a una tabla de staging con
+# el exportador recibido (Data API o UNLOAD), las mergea en la tabla final y recien ahi avanza la marca de agua
+def sync_table_incremental(redshift_data, s3_client, client, wait_for_statement, export, tabla, table_id):
+    watermark = read_sync_watermark(s3_client, tabla)
+    upper_bound = fetch_delta_upper_bound(redshift_data, wait_for_statement, tabla, watermark)
+    if upper_bound is None:
+        print(f"✅ {tabla} ya esta sincronizada hasta {watermark}")
+        return 0
+
+    sql = f"SELECT * FROM {tabla} WHERE {build_delta_filter(tabla, watermark, upper_bound)}"
+    staging_id = staging_table_id(table_id)
+    try:
+        total_rows = export(sql, staging_id)
+        if total_rows:
+            merge_staging_table(client, staging_id, table_id, SYNC_TABLES[tabla]['keys'])
+    finally:
+        drop_staging_table(client, staging_id)
+
+    save_sync_watermark(s3_client, tabla, upper_bound)
+    return total_rows
@@ -1,189 +1,181 @@
 import boto3
 import pandas as pd
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 import time
 import json
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-
-# Funcion para obtener la API Key de Google Cloud y consumir la API de Gmail
-def get_secret(SECRET_NAME, REGION_NAME):
-    client = boto3.client('secretsmanager', region_name=REGION_NAME)
-    response = client.get_secret_value(SecretId=SECRET_NAME)
-    return json.loads(response['SecretString'])
-
-def update_secret(updated_token_json, SECRET_NAME, REGION_NAME):
-    client = boto3.client('secretsmanager', region_name=REGION_NAME)
-    client.update_secret(
-        SecretId=SECRET_NAME,
-        SecretString=updated_token_json
-    )
+from concurrent.futures import ThreadPoolExecutor
+from credentials_cache import get_google_credentials
+from unload_transfer import export_query_via_unload
+from incremental_sync import sync_table_incremental, staging_table_id, drop_staging_table, SYNC_TABLES
+from redshift_results import decode_page, to_dataframe
+from schema_registry import get_table_schema
+
+SYNC_WORKERS = 4
+LOAD_CHUNK_ROWS = 50000  # Filas por load job: se juntan varias paginas de la Data API para no agotar la cuota de loads
 
+# Funcion para obtener las credenciales de Google Cloud y consumir la API de Gmail, cacheadas en el contenedor
 def auth_google(SECRET_NAME):
     SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-    REGION_NAME = 'us-east-2'    
-    token_info = get_secret(SECRET_NAME, REGION_NAME)
-    creds = Credentials.from_authorized_user_info(token_info, SCOPES)
-    
-    if creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        print("♻️ Token refrescado")
-
-        # Guardar el token actualizado en Secrets Manager
-        update_secret(creds.to_json(), SECRET_NAME, REGION_NAME)
-
-    return creds
-
-# Función para inferir y convertir tipos de datos
-def convert_column_types(df, table_name):
-    """
-    Intenta convertir las columnas del dataframe a los tipos de datos apropiados
-    basado en el nombre de la tabla y los nombres de las columnas.
-    """
-    if table_name == 'mp_data':
-        # Mapeo de tipos para la tabla mp_data
-        type_mapping = {
-            'source_id': 'string',
-            'report_id': 'string',
-            'report_date': 'datetime64[ns]',
-            'settlement_date': 'datetime64[ns]',
-            'payment_method_type': 'string',
-            'transaction_type': 'string',
-            'transaction_amount': 'float64',
-            'transaction_date': 'datetime64[ns]',
-            'real_amount': 'float64',
-            'pos_id': 'string',
-            'store_id': 'string',
-            'store_name': 'string',
-            'payer_name': 'string',
-            'business_unit': 'string',
-            'sub_unit': 'string'
-        }
-    elif table_name == 'bank_payments':
-        # Mapeo de tipos para la tabla bank_payments
-        type_mapping = {
-            'comercio' : 'string',
-            'cuotas': 'int64',
-            'extraido_en': 'datetime64[ns]',
-            'fecha_pago': 'datetime64[ns]',
-            'hora_pago': 'datetime64[ns]',
-            'id' : 'string',
-            'message_id' : 'string',
-            'monto': 'float64',
-            'nro_tarjeta' : 'string',
-            'tarjeta' : 'string',
-        }
-    else: # market-tickets
-        # Mapeo de tipos para la tabla carrefour_data
-        type_mapping = {
-            'nro_ticket': 'int64',
-            'fecha': 'datetime64[ns]',
-            'categ': 'string',
-            'prod': 'string',
-            'cant': 'int64',
-            'peso': 'float64',
-            'p_unit': 'float64',
-            'p_total': 'float64',
-            'total_ticket_bruto': 'float64',
-            'total_ticket_meli': 'float64'
-        }
-    
-    for col in df.columns:
-        # Si tenemos un mapeo específico, lo usamos
-        if col in type_mapping:
-            target_type = type_mapping[col]
-            try:
-                if target_type.startswith('datetime'):
-                    df[col] = pd.to_datetime(df[col])
-                else:
-                    df[col] = df[col].astype(target_type)
-            except (ValueError, TypeError) as e:
-                print(f"⚠️ No se pudo convertir la columna {col} a {target_type}: {e}")
-                # Mantenemos el tipo original si falla la conversión
-                continue
+    return get_google_credentials(SECRET_NAME, SCOPES)
+
+# Funcion para esperar a que termine una sentencia de la Data API de Redshift
+def wait_for_statement(redshift_data, statement_id):
+    while True:
+        desc = redshift_data.describe_statement(Id=statement_id)
+        if desc['Status'] in ('FINISHED', 'FAILED', 'ABORTED'):
+            return desc
+        time.sleep(1)
+
+# Funcion que recorre todas las paginas del resultado de una sentencia siguiendo el NextToken
+def iter_result_pages(redshift_data, statement_id):
+    kwargs = {'Id': statement_id}
+    while True:
+        page = redshift_data.get_statement_result(**kwargs)
+        yield page
+        if not page.get('NextToken'):
+            break
+        kwargs['NextToken'] = page['NextToken']
+
+# Funcion que exporta el resultado de una query a BigQuery por tandas. Las paginas de la Data API se juntan hasta
+# LOAD_CHUNK_ROWS filas y cada tanda se agrega a la tabla con un load job propio; mientras corre se siguen descargando
+# paginas, asi en memoria hay como mucho dos tandas. La tabla destino es siempre una tabla de staging
+def export_query_to_bigquery(redshift_data, client, sql, tabla, table_id):
+    response = redshift_data.execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sql=sql
+    )
+    query_id = response['Id']
+    status = wait_for_statement(redshift_data, query_id)
+    if status['Status'] != 'FINISHED':
+        raise Exception(f"Query falló: {status.get('Error')}")
+    if not status.get('HasResultSet'):
+        print("⚠️ La query no devuelve resultados.")
+        return 0
+
+    column_metadata = None
+    job_config = None
+    pending_job = None
+    chunk, chunk_rows = [], 0
+    total_rows = 0
+
+    def load_chunk():
+        nonlocal pending_job, chunk, chunk_rows, total_rows
+        df = pd.concat(chunk, ignore_index=True)
+        if pending_job is not None:
+            pending_job.result()
+        pending_job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+        total_rows += chunk_rows
+        print(f"📦 Tanda de {chunk_rows} filas enviada a BigQuery ({total_rows} en total)")
+        chunk, chunk_rows = [], 0
+
+    for page in iter_result_pages(redshift_data, query_id):
+        # La Data API solo manda el ColumnMetadata en la primera pagina
+        if column_metadata is None:
+            column_metadata = page['ColumnMetadata']
+            schema = get_table_schema(tabla, column_metadata)
+            job_config = bigquery.LoadJobConfig(
+                schema=schema.bigquery_schema(),
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+            )
+        if not page['Records']:
+            continue
+
+        df = schema.apply(to_dataframe(decode_page(page, column_metadata)))
+        chunk.append(df)
+        chunk_rows += len(df)
+        if chunk_rows >= LOAD_CHUNK_ROWS:
+            load_chunk()
+
+    if chunk:
+        load_chunk()
+    if pending_job is not None:
+        pending_job.result()  # Esperar a que termine la ultima tanda
+    return total_rows
+
+# Funcion para reemplazar la tabla final por la de staging con un copy job, que cambia datos y esquema de una sola vez
+def replace_table(client, staging_id, table_id):
+    job_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    client.copy_table(staging_id, table_id, job_config=job_config).result()
+
+# Funcion para vaciar la tabla final cuando la tabla de Redshift ya no tiene filas (si no existe no hay nada que vaciar)
+def truncate_table(client, table_id):
+    try:
+        client.get_table(table_id)
+    except NotFound:
+        return
+    client.query(f"TRUNCATE TABLE `{table_id}`").result()
+
+# Funcion que sincroniza una tabla con los clientes compartidos de la invocacion, devuelve la cantidad de filas cargadas
+def sync_table(redshift_data, s3_client, client, project_id, tabla, modo, sync):
+    # # table_id = 'hazel-pillar-400222.etl_expenses_no_redshift.bank_payments'
+    table_id = f'{project_id}.etl_expenses_no_redshift.{tabla}'
+
+    def export(sql, destination_id):
+        if modo == 'unload':
+            return export_query_via_unload(redshift_data, s3_client, client, sql, tabla, destination_id)
+        return export_query_to_bigquery(redshift_data, client, sql, tabla, destination_id)
+
+    if sync == 'incremental' and tabla in SYNC_TABLES:
+        return sync_table_incremental(redshift_data, s3_client, client, wait_for_statement, export, tabla, table_id)
+
+    # Copia completa: se carga en una tabla de staging y solo si termino entera reemplaza a la tabla final, asi un
+    # error a mitad de la exportacion no deja la tabla con filas parciales ni duplicadas
+    staging_id = staging_table_id(table_id)
+    try:
+        total_rows = export(f"SELECT * FROM {tabla}", staging_id)
+        if total_rows:
+            replace_table(client, staging_id, table_id)
         else:
-            # Intento de inferencia automática para columnas no mapeadas
-            try:
-                # Primero intentamos convertir a numérico
-                numeric_vals = pd.to_numeric(df[col], errors='raise')
-                # Si todos los valores son enteros, usamos int64, sino float64
-                if (numeric_vals % 1 == 0).all():
-                    df[col] = numeric_vals.astype('int64')
-                else:
-                    df[col] = numeric_vals.astype('float64')
-                print(f"✅ Convertida columna {col} a numérico")
-                continue
-            except (ValueError, TypeError):
-                pass
-            
-            try:
-                # Intentamos convertir a fecha/hora
-                datetime_vals = pd.to_datetime(df[col], errors='raise')
-                df[col] = datetime_vals
-                print(f"✅ Convertida columna {col} a datetime")
-                continue
-            except (ValueError, TypeError):
-                pass
-            
-            # Si no es numérico ni fecha, lo dejamos como string
-            df[col] = df[col].astype('string')
-    
-    return df
+            # Sin filas no se llega a crear el staging: la copia completa de una tabla vacia es una tabla vacia
+            truncate_table(client, table_id)
+    finally:
+        drop_staging_table(client, staging_id)
+    return total_rows
+
+# Funcion que corre una sincronizacion y mide su duracion, los errores quedan en el resultado de la tabla
+def timed_sync(redshift_data, s3_client, client, project_id, tabla, modo, sync):
+    inicio = time.monotonic()
+    try:
+        filas = sync_table(redshift_data, s3_client, client, project_id, tabla, modo, sync)
+        print(f"✅ Carga exitosa de {tabla} a BigQuery: {filas} filas")
+        return {'tabla': tabla, 'filas': filas, 'segundos': round(time.monotonic() - inicio, 2)}
+    except Exception as e:
+        print(f"⚠️ Error al sincronizar {tabla}: {e}")
+        return {'tabla': tabla, 'error': str(e), 'segundos': round(time.monotonic() - inicio, 2)}
 
 def lambda_handler(event, context):
     try:
         redshift_data = boto3.client('redshift-data')
-        tabla = event["tabla"]
+        s3_client = boto3.client('s3')
+        # Se puede sincronizar una tabla ("tabla") o varias en paralelo ("tablas")
+        tablas = event.get("tablas") or [event["tabla"]]
+        # Modo de transferencia: 'data_api' pagina el resultado por la Data API, 'unload' pasa por archivos Parquet en S3
+        modo = event.get("modo", "data_api")
+        # Tipo de sincronizacion: 'full' copia toda la tabla, 'incremental' solo las filas nuevas desde la marca de agua
+        sync = event.get("sync", "full")
 
+        # Credenciales y cliente de BigQuery compartidos por todas las tablas de la invocacion
         creds = auth_google('gcp_credentials')
-
-        response = redshift_data.execute_statement(
-            Database='dev',
-            WorkgroupName='pdf-etl-workgroup',
-            Sql= f"SELECT * FROM {tabla}"
-        )
-
-        query_id = response['Id']
-        while True:
-            status = redshift_data.describe_statement(Id=query_id)
-            if status['Status'] == 'FAILED':
-                print("❌ Query falló:", status['Error'])
-                break
-            elif status['Status'] == 'FINISHED':
-                if status.get('HasResultSet'):
-                    results = redshift_data.get_statement_result(Id=query_id)
-                    break
-                else:
-                    print("⚠️ La query no devuelve resultados.")
-                    break
-            time.sleep(1)
-
-        column_names = [col['name'] for col in results['ColumnMetadata']]
-        parsed_rows = []
-        for record in results['Records']:
-            parsed_row = []
-            for cell in record:
-                # Extrae el primer valor del diccionario (stringValue, longValue, etc.)
-                value = list(cell.values())[0]
-                parsed_row.append(value)
-            parsed_rows.append(dict(zip(column_names, parsed_row)))
-        df = pd.DataFrame(parsed_rows)
-
-        # Después de obtener tu dataframe df, antes de cargarlo a BigQuery:
-        df = convert_column_types(df, tabla)
         project_id = 'hazel-pillar-400222'
-
         client = bigquery.Client(credentials=creds, project=f'{project_id}')
-        # # table_id = 'hazel-pillar-400222.etl_expenses_no_redshift.bank_payments'
-        table_id = f'{project_id}.etl_expenses_no_redshift.{tabla}'
 
-        job = client.load_table_from_dataframe(df, table_id)
-        job.result()  # Esperar a que termine
-        print("✅ Carga exitosa a BigQuery")
+        with ThreadPoolExecutor(max_workers=min(len(tablas), SYNC_WORKERS)) as executor:
+            resultados = list(executor.map(
+                lambda tabla: timed_sync(redshift_data, s3_client, client, project_id, tabla, modo, sync),
+                tablas
+            ))
+
+        errores = [resultado for resultado in resultados if 'error' in resultado]
+        return {
+            "statusCode": 500 if errores else 200,
+            "body": json.dumps({"tablas": resultados})
+        }
 
     except Exception as e:
         print("⚠️ Error:", str(e))
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,108 @@
+import pandas as pd
+from google.cloud import bigquery
+from redshift_results import INTEGER_TYPES, FLOAT_TYPES, NUMERIC_TYPES, BOOLEAN_TYPES, DATETIME_TYPES
+
+# Registro de esquemas de las tablas que se sincronizan a BigQuery. El tipo de cada columna se deriva una sola vez
+# por contenedor del ColumnMetadata de Redshift, con overrides para las columnas que Redshift guarda como VARCHAR
+# pero que en BigQuery se cargan tipadas. Con el esquema resuelto las conversiones se aplican columna por columna
+# en una sola pasada (sin inferencia por excepciones) y el load job recibe un esquema explicito, sin autodetect.
+
+# Tipos logicos de las columnas que Redshift guarda como VARCHAR pero que en BigQuery se cargan tipadas. El resto de
+# las columnas toma el tipo que informa el ColumnMetadata
+COLUMN_OVERRIDES = {
+    'mp_data': {
+        'report_date': 'datetime',
+        'settlement_date': 'datetime',
+        'transaction_date': 'datetime',
+    },
+    'carrefour_data': {
+        'nro_ticket': 'int64',
+        'fecha': 'datetime',
+        'cant': 'int64',
+        'peso': 'float64',
+        'p_unit': 'float64',
+        'p_total': 'float64',
+        'total_ticket_bruto': 'float64',
+        'total_ticket_meli': 'float64'
+    },
+}
+
+# Formatos de fecha de las columnas guardadas como texto, se prueban en orden (los tickets traen el año con cuatro o
+# con dos digitos segun la version del pdf)
+DATETIME_FORMATS = {
+    ('carrefour_data', 'fecha'): ['%d/%m/%Y', '%d/%m/%y'],
+}
+
+TIME_TYPES = {'time', 'timetz'}
+
+BIGQUERY_TYPES = {
+    'string': 'STRING',
+    'int64': 'INT64',
+    'float64': 'FLOAT64',
+    'boolean': 'BOOL',
+    'datetime': 'DATETIME',
+    'time': 'TIME',
+}
+
+_schemas = {}
+
+# Funcion para traducir un tipo de Redshift al tipo logico del registro
+def logical_type(redshift_type):
+    redshift_type = (redshift_type or '').lower()
+    if redshift_type in INTEGER_TYPES:
+        return 'int64'
+    if redshift_type in FLOAT_TYPES or redshift_type in NUMERIC_TYPES:
+        return 'float64'
+    if redshift_type in BOOLEAN_TYPES:
+        return 'boolean'
+    if redshift_type in DATETIME_TYPES:
+        return 'datetime'
+    if redshift_type in TIME_TYPES:
+        return 'time'
+    return 'string'
+
+class TableSchema:
+    def __init__(self, table_name, columns):
+        self.table_name = table_name
+        self.columns = columns  # lista de (columna, tipo logico) en el orden de Redshift
+
+    def bigquery_schema(self):
+        return [bigquery.SchemaField(name, BIGQUERY_TYPES[kind]) for name, kind in self.columns]
+
+    # Convierte cada columna a su tipo logico, los valores que no se pueden convertir quedan nulos
+    def apply(self, df):
+        for name, kind in self.columns:
+            if name not in df.columns:
+                continue
+            if kind == 'int64':
+                df[name] = pd.to_numeric(df[name], errors='coerce').round().astype('Int64')
+            elif kind == 'float64':
+                df[name] = pd.to_numeric(df[name], errors='coerce').astype('float64')
+            elif kind == 'datetime':
+                formats = DATETIME_FORMATS.get((self.table_name, name))
+                if formats is None:
+                    df[name] = pd.to_datetime(df[name], errors='coerce')
+                else:
+                    parsed = pd.to_datetime(df[name], format=formats[0], errors='coerce')
+                    for fmt in formats[1:]:
+                        parsed = parsed.fillna(pd.to_datetime(df[name], format=fmt, errors='coerce'))
+                    df[name] = parsed
+            elif kind == 'time':
+                parsed = pd.to_datetime(df[name].astype('string'), format='%H:%M:%S', errors='coerce')
+                df[name] = parsed.dt.time.where(parsed.notna(), None)
+            elif kind == 'boolean':
+                df[name] = df[name].astype('boolean')
+            else:
+                df[name] = df[name].astype('string')
+        return df
+
+# Funcion para obtener el esquema de una tabla a partir del ColumnMetadata de la Data API, cacheado en el contenedor
+def get_table_schema(table_name, column_metadata):
+    if table_name not in _schemas:
+        overrides = COLUMN_OVERRIDES.get(table_name, {})
+        columns = [
+            (col['name'], overrides.get(col['name'], logical_type(col.get('typeName'))))
+            for col in column_metadata
+        ]
+        _schemas[table_name] = TableSchema(table_name, columns)
+    return _schemas[table_name]
@@ -7,38 +7,14 @@ import io
 from datetime import datetime, timedelta
 import base64
 from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from credentials_cache import get_google_credentials
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
 
-# Funcion para obtener la API Key de Google Cloud y consumir la API de Gmail
-def get_secret(SECRET_NAME, REGION_NAME):
-    client = boto3.client('secretsmanager', region_name=REGION_NAME)
-    response = client.get_secret_value(SecretId=SECRET_NAME)
-    return json.loads(response['SecretString'])
-
-def update_secret(updated_token_json, SECRET_NAME, REGION_NAME):
-    client = boto3.client('secretsmanager', region_name=REGION_NAME)
-    client.update_secret(
-        SecretId=SECRET_NAME,
-        SecretString=updated_token_json
-    )
-
+# Funcion para obtener las credenciales de Google Cloud y consumir la API de Gmail, cacheadas en el contenedor
 def auth_google(SECRET_NAME):
     SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-    REGION_NAME = 'us-east-2'    
-    token_info = get_secret(SECRET_NAME, REGION_NAME)
-    creds = Credentials.from_authorized_user_info(token_info, SCOPES)
-    
-    if creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        print("♻️ Token refrescado")
-
-        # Guardar el token actualizado en Secrets Manager
-        update_secret(creds.to_json(), SECRET_NAME, REGION_NAME)
-
-    return creds
+    return get_google_credentials(SECRET_NAME, SCOPES)
 
 def find_html_part(payload):
     if payload.get("mimeType") == "text/html":
@@ -0,0 +1,150 @@
+import os
+import tempfile
+import time
+import uuid
+from google.cloud import bigquery
+from schema_registry import get_table_schema, logical_type, DATETIME_FORMATS
+
+# Transferencia Redshift -> BigQuery por archivos. Redshift escribe el resultado con UNLOAD ... FORMAT PARQUET en un
+# prefijo de staging de S3 y cada archivo Parquet se sube a BigQuery como un load job de archivo, asi la Lambda
+# nunca arma las filas en memoria: solo pasa bytes de S3 a BigQuery a traves de /tmp. Como Parquet conserva los tipos
+# de Redshift, el SELECT del UNLOAD convierte cada columna al tipo del registro de esquemas (las fechas y numeros
+# guardados como VARCHAR, los DECIMAL a FLOAT64) y el load job recibe ese mismo esquema explicito.
+UNLOAD_BUCKET = os.environ.get('UNLOAD_BUCKET', 'redshift-unload-staging')
+UNLOAD_PREFIX = 'unload/'
+UNLOAD_IAM_ROLE = os.environ.get('UNLOAD_IAM_ROLE', 'default')
+MAX_FILE_SIZE_MB = 256  # Cada archivo tiene que entrar en el /tmp de la Lambda
+
+# Equivalente en Redshift de los formatos de fecha del registro: expresion regular que valida el texto y formato de TO_DATE.
+# Las expresiones evitan la barra invertida porque la query viaja escapada dentro del literal del UNLOAD
+REDSHIFT_DATE_FORMATS = {
+    '%d/%m/%Y': ('^[0-9]{2}/[0-9]{2}/[0-9]{4}$', 'DD/MM/YYYY'),
+    '%d/%m/%y': ('^[0-9]{2}/[0-9]{2}/[0-9]{2}$', 'DD/MM/YY'),
+}
+
+# Funcion para obtener el ColumnMetadata de una query sin traer filas
+def fetch_column_metadata(redshift_data, sql):
+    response = redshift_data.execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sql=f"SELECT * FROM ({sql}) AS origen LIMIT 0"
+    )
+    while True:
+        desc = redshift_data.describe_statement(Id=response['Id'])
+        if desc['Status'] in ('FINISHED', 'FAILED', 'ABORTED'):
+            break
+        time.sleep(0.5)
+    if desc['Status'] != 'FINISHED':
+        raise Exception(f"No se pudo obtener el esquema de la query: {desc.get('Error')}")
+    return redshift_data.get_statement_result(Id=response['Id'])['ColumnMetadata']
+
+# Funcion que arma la expresion SQL que convierte una columna de Redshift al tipo logico del registro. Los textos que
+# no tienen el formato esperado quedan nulos, igual que con errors='coerce' en la exportacion por la Data API
+def typed_column(tabla, name, redshift_type, kind):
+    stored_as_text = logical_type(redshift_type) == 'string'
+    if kind == 'int64':
+        if stored_as_text:
+            return f"CASE WHEN TRIM({name}) ~ '^-?[0-9]+$' THEN CAST(TRIM({name}) AS BIGINT) END"
+        return f"CAST({name} AS BIGINT)"
+    if kind == 'float64':
+        if stored_as_text:
+            return f"CASE WHEN TRIM({name}) ~ '^-?[0-9]+([.][0-9]+)?$' THEN CAST(TRIM({name}) AS DOUBLE PRECISION) END"
+        return f"CAST({name} AS DOUBLE PRECISION)"
+    if kind == 'datetime':
+        if not stored_as_text:
+            return f"CAST({name} AS TIMESTAMP)"
+        formats = DATETIME_FORMATS.get((tabla, name))
+        if formats is None:
+            # Fechas ISO (YYYY-MM-DD con hora opcional), como las de los reportes de Mercado Pago
+            return (
+                f"CASE WHEN {name} ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}' "
+                f"THEN CAST(LEFT(REPLACE({name}, 'T', ' '), 19) AS TIMESTAMP) END"
+            )
+        cases = ' '.join(
+            f"WHEN {name} ~ '{REDSHIFT_DATE_FORMATS[fmt][0]}' THEN CAST(TO_DATE({name}, '{REDSHIFT_DATE_FORMATS[fmt][1]}') AS TIMESTAMP)"
+            for fmt in formats
+        )
+        return f"CASE {cases} END"
+    return name
+
+# Funcion para envolver la query en un SELECT que deja cada columna con el tipo del esquema de BigQuery
+def build_typed_sql(sql, tabla, schema, column_metadata):
+    redshift_types = {col['name']: col.get('typeName') for col in column_metadata}
+    columns = ', '.join(
+        f"{typed_column(tabla, name, redshift_types[name], kind)} AS {name}"
+        for name, kind in schema.columns
+    )
+    return f"SELECT {columns} FROM ({sql}) AS origen"
+
+# Funcion para escapar una query dentro del literal del UNLOAD
+def quote_sql_literal(sql):
+    return "'" + sql.replace("'", "''") + "'"
+
+# Funcion para armar la sentencia UNLOAD de una query hacia un prefijo de S3
+def build_unload_sql(sql, bucket_name, prefix, iam_role=UNLOAD_IAM_ROLE):
+    role = 'default' if iam_role == 'default' else quote_sql_literal(iam_role)
+    return (
+        f"UNLOAD ({quote_sql_literal(sql)}) "
+        f"TO 's3://{bucket_name}/{prefix}' "
+        f"IAM_ROLE {role} "
+        f"FORMAT PARQUET MAXFILESIZE {MAX_FILE_SIZE_MB} MB"
+    )
+
+# Funcion para ejecutar el UNLOAD y esperar a que Redshift termine de escribir los archivos
+def unload_to_s3(redshift_data, sql, bucket_name, prefix):
+    response = redshift_data.execute_statement(
+        Database='dev',
+        WorkgroupName='pdf-etl-workgroup',
+        Sql=build_unload_sql(sql, bucket_name, prefix)
+    )
+    while True:
+        desc = redshift_data.describe_statement(Id=response['Id'])
+        if desc['Status'] in ('FINISHED', 'FAILED', 'ABORTED'):
+            break
+        time.sleep(1)
+    if desc['Status'] != 'FINISHED':
+        raise Exception(f"UNLOAD falló: {desc.get('Error')}")
+
+def list_staged_files(s3_client, bucket_name, prefix):
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Size'] > 0)
+    return keys
+
+# Funcion para borrar los archivos de staging una vez cargados (delete_objects acepta hasta 1000 claves)
+def cleanup_staged_files(s3_client, bucket_name, keys):
+    for i in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True}
+        )
+
+# Funcion que exporta el resultado de una query a BigQuery via UNLOAD a Parquet. Devuelve la cantidad de filas cargadas
+def export_query_via_unload(redshift_data, s3_client, client, sql, tabla, table_id, bucket_name=UNLOAD_BUCKET):
+    column_metadata = fetch_column_metadata(redshift_data, sql)
+    schema = get_table_schema(tabla, column_metadata)
+
+    prefix = f"{UNLOAD_PREFIX}{tabla}/{uuid.uuid4().hex}/"
+    unload_to_s3(redshift_data, build_typed_sql(sql, tabla, schema, column_metadata), bucket_name, prefix)
+    keys = list_staged_files(s3_client, bucket_name, prefix)
+    print(f"📦 UNLOAD de {tabla} generó {len(keys)} archivo(s) Parquet en s3://{bucket_name}/{prefix}")
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        schema=schema.bigquery_schema(),
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+    )
+    total_rows = 0
+    try:
+        for key in keys:
+            with tempfile.TemporaryFile(dir='/tmp') as staged_file:
+                s3_client.download_fileobj(bucket_name, key, staged_file)
+                staged_file.seek(0)
+                job = client.load_table_from_file(staged_file, table_id, job_config=job_config, rewind=True)
+                job.result()
+            total_rows += job.output_rows or 0
+    finally:
+        cleanup_staged_files(s3_client, bucket_name, keys)
+
+    return total_rows
@@ -0,0 +1,63 @@
+import time
+import threading
+import boto3
+from botocore.exceptions import ClientError
+
+# Registro de entregas del webhook ya procesadas. Mercado Pago reintenta las notificaciones, asi que antes de
+# disparar la Step Function "reclamamos" la clave de la entrega con una escritura condicional: solo la primera
+# entrega la obtiene, los reintentos posteriores se responden con 200 sin iniciar otra ejecucion.
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+def delivery_key(transaction_id, file_name):
+    return f"{transaction_id}:{file_name}"
+
+# Store productivo sobre DynamoDB, la expiracion la maneja el TTL de la tabla sobre el atributo expires_at
+class DynamoIdempotencyStore:
+    def __init__(self, table_name, ttl_seconds=DEFAULT_TTL_SECONDS, dynamodb=None):
+        self.table = (dynamodb or boto3.resource('dynamodb')).Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def claim(self, key):
+        now = int(time.time())
+        try:
+            # El TTL de DynamoDB puede tardar en borrar los items vencidos, por eso tambien aceptamos pisar uno expirado
+            self.table.put_item(
+                Item={'idempotency_key': key, 'created_at': now, 'expires_at': now + self.ttl_seconds},
+                ConditionExpression='attribute_not_exists(idempotency_key) OR expires_at < :now',
+                ExpressionAttributeValues={':now': now}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def release(self, key):
+        self.table.delete_item(Key={'idempotency_key': key})
+
+# Store en memoria con la misma interfaz, para pruebas locales o cuando no hay tabla configurada
+class InMemoryIdempotencyStore:
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def claim(self, key):
+        now = time.time()
+        with self.lock:
+            expires_at = self.items.get(key)
+            if expires_at is not None and expires_at >= now:
+                return False
+            self.items[key] = now + self.ttl_seconds
+            return True
+
+    def release(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+# Funcion para elegir el store segun la configuracion de la Lambda
+def build_idempotency_store(table_name=None, ttl_seconds=DEFAULT_TTL_SECONDS):
+    if table_name:
+        return DynamoIdempotencyStore(table_name, ttl_seconds)
+    print("⚠️ Sin tabla de idempotencia configurada, se usa un store en memoria del contenedor.")
+    return InMemoryIdempotencyStore(ttl_seconds)
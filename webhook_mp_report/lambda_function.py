@@ -1,43 +1,91 @@
-import bcrypt
 import json
 import os
 import boto3
+from idempotency import build_idempotency_store, delivery_key, DEFAULT_TTL_SECONDS
+from signature_verifier import SignatureVerifier, DEFAULT_CACHE_SIZE
+from notification_batcher import build_notification_queue, build_batch_input, notifications_from_records
+
+# Clientes y configuracion del contenedor, se crean una sola vez y se reutilizan entre invocaciones
+step_functions_client = boto3.client('stepfunctions')
+signature_verifier = SignatureVerifier(
+    os.environ["CIFRADO_SECRET_MP"],
+    int(os.environ.get('SIGNATURE_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+)
+
+# Registro de entregas ya procesadas, se crea una vez por contenedor
+idempotency_store = build_idempotency_store(
+    os.environ.get('IDEMPOTENCY_TABLE'),
+    int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+)
+
+# Modo batching: las notificaciones se encolan y se inicia una ejecucion por lote en lugar de una por notificacion
+notification_queue = None
+if os.environ.get('NOTIFICATION_BATCHING', 'false').lower() == 'true':
+    notification_queue = build_notification_queue(os.environ.get('NOTIFICATION_QUEUE_URL'))
+
+# Funcion para iniciar una ejecucion de la Step Function con la lista de reportes a procesar
+def start_batch_execution(notifications):
+    step_input = build_batch_input(notifications)
+    response = step_functions_client.start_execution(
+        stateMachineArn=os.environ['STEP_FUNCTION_ARN'],
+        input=json.dumps(step_input)
+    )
+    print(f"🚀 Step Function iniciada con {len(step_input['files'])} reporte(s): {response['executionArn']}")
+    return response
+
+# Funcion que consume un lote de la cola de SQS (ventana del event source mapping) y lo despacha en una sola ejecucion.
+# Si falla se propaga el error para que SQS vuelva a entregar el lote completo
+def dispatch_queued_notifications(records):
+    notifications = notifications_from_records(records)
+    start_batch_execution(notifications)
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f'{len(notifications)} notifications dispatched')
+    }
 
 def lambda_handler(event, context):
-    step_function_arn = os.environ['STEP_FUNCTION_ARN']
-    step_functions_client = boto3.client('stepfunctions')
-    
-    # Extraer parámetros del POST
-    CIFRADO_SECRET = os.environ["CIFRADO_SECRET_MP"]
-    
+    if event.get("Records"):
+        return dispatch_queued_notifications(event["Records"])
+
     # 1. Obtener el cuerpo del request
     raw_body = event["body"]
     body_json = json.loads(raw_body)
 
     try:
         # 2. Extraer los campos necesarios para la firma
-        try:
-            transaction_id = body_json.get("transaction_id", "")
-            generation_date = body_json.get("generation_date", "")
-            firma_enviada = body_json.get("signature", "")
-        except:
-            if not transaction_id:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Faltan el campo requerido transaction_id"})
-                }
-            elif not generation_date:
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Faltan el campo requerido generation_date"})
-                }
-            else: # not firma_enviada
-                return {
-                    "statusCode": 400,
-                    "body": json.dumps({"error": "Faltan el campo requerido firma_enviada"})
-                }
+        transaction_id = body_json.get("transaction_id", "")
+        generation_date = body_json.get("generation_date", "")
+        firma_enviada = body_json.get("signature", "")
+        if not transaction_id:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "Faltan el campo requerido transaction_id"})
+            }
+        elif not generation_date:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "Faltan el campo requerido generation_date"})
+            }
+        elif not firma_enviada:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "Faltan el campo requerido firma_enviada"})
+            }
+
+        # 3. Verificar la firma con bcrypt, los reintentos de una notificacion ya verificada salen del cache
+        if not signature_verifier.verify(transaction_id, generation_date, firma_enviada):
+            print("❌ Firma inválida")
+            return {
+                "statusCode": 403,
+                "body": json.dumps({"message": "Firma inválida"})
+            }
+
+        print("✅ Webhook válido!")
         
         file = body_json.get("files", "")
+        # Mercado Pago puede enviar los archivos como lista, nos quedamos con el primero
+        if isinstance(file, list):
+            file = file[0] if file else {}
         file_name = file.get("name", "")
         file_url = file.get("url", "")
         file_type = file.get("type", "")
@@ -46,33 +94,45 @@ def lambda_handler(event, context):
         step_input = {
             "file_name" : file_name,
             "file_url": file_url,
-            "file_type" : file_type
+            "file_type" : file_type,
+            "transaction_id": transaction_id,
+            "generation_date": generation_date
         }
 
-        # # 3. Construir la cadena exacta que MercadoPago usó para la firma
-        # cadena_para_firma = f"{transaction_id}-{CIFRADO_SECRET}-{generation_date}"
-        # cadena_para_firma_bytes = cadena_para_firma.encode("utf-8")
+        # Si esta entrega ya se proceso (reintento de Mercado Pago) respondemos 200 sin iniciar otra ejecucion
+        clave_entrega = delivery_key(transaction_id, file_name)
+        if not idempotency_store.claim(clave_entrega):
+            print(f"🔁 Entrega duplicada {clave_entrega}, se ignora.")
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Notification already processed')
+            }
 
-        # print("🔑 Cadena para firma:", cadena_para_firma)
-
-        # # 4. Verificar con bcrypt.checkpw()
-        # if not bcrypt.checkpw(cadena_para_firma_bytes, firma_enviada.encode("utf-8")):
-        #     print("❌ Firma inválida")
-        #     return {
-        #         "statusCode": 403,
-        #         "body": json.dumps({"message": "Firma inválida"})
-        #     }
+        try:
+            if notification_queue is None:
+                start_batch_execution([step_input])
+            else:
+                notification_queue.send(step_input)
+        except Exception:
+            # Liberamos la clave para que el proximo reintento de Mercado Pago pueda volver a disparar el flujo
+            idempotency_store.release(clave_entrega)
+            raise
 
-        # print("✅ Webhook válido!")
-        
-        response = step_functions_client.start_execution(
-            stateMachineArn=step_function_arn,
-            input=json.dumps(step_input)
-        )
+        if notification_queue is not None:
+            # Los lotes los despacha el event source mapping de SQS
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Notification queued')
+            }
         
         return {
             'statusCode': 200,
             'body': json.dumps('Step Function started successfully!')
         }
     except Exception as e:
-        print(f"⚠️ Error al recibir webhook y enviar datos a step function: {e}")
\ No newline at end of file
+        print(f"⚠️ Error al recibir webhook y enviar datos a step function: {e}")
+        # Respondemos 500 para que Mercado Pago reintente la notificacion, si se habia reservado la entrega ya se libero
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+import bcrypt
+
+# Verificacion de la firma de los webhooks de Mercado Pago. bcrypt.checkpw es lento a proposito (cientos de ms
+# con el costo que usa Mercado Pago), asi que las tuplas (transaction_id, generation_date, signature) ya
+# verificadas quedan en un LRU acotado del contenedor: los reintentos de la misma notificacion se validan sin
+# volver a correr bcrypt. Solo se cachean firmas validas, una firma invalida siempre paga el checkpw completo.
+DEFAULT_CACHE_SIZE = 1024
+
+class SignatureVerifier:
+    def __init__(self, secret, max_entries=DEFAULT_CACHE_SIZE):
+        self.secret = secret
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.verified = OrderedDict()
+
+    # Cadena exacta que Mercado Pago usa para generar la firma
+    def signed_payload(self, transaction_id, generation_date):
+        return f"{transaction_id}-{self.secret}-{generation_date}".encode("utf-8")
+
+    def verify(self, transaction_id, generation_date, signature):
+        if not transaction_id or not generation_date or not signature:
+            return False
+
+        cache_key = (transaction_id, generation_date, signature)
+        with self.lock:
+            if cache_key in self.verified:
+                self.verified.move_to_end(cache_key)
+                return True
+
+        try:
+            valida = bcrypt.checkpw(self.signed_payload(transaction_id, generation_date), signature.encode("utf-8"))
+        except ValueError:
+            # La firma no tiene formato de hash bcrypt
+            valida = False
+        if not valida:
+            return False
+
+        with self.lock:
+            self.verified[cache_key] = True
+            self.verified.move_to_end(cache_key)
+            while len(self.verified) > self.max_entries:
+                self.verified.popitem(last=False)
+        return True